@@ -0,0 +1,273 @@
+import csv
+import logging
+import mmap
+import os
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+
+logger = logging.getLogger(__name__)
+
+# Expansions with up to this many values are rendered up front, bigger ones are only rendered when accessed
+MATERIALIZE_LIMIT = 4096
+
+
+def size_of(values) -> int:
+    """
+    Get the number of values in a sequence.  Unlike `len`, this works for lazy sequences with more values than
+    fit in a machine sized integer.
+
+    :param values: A list or lazy sequence
+    :return: int - The number of values
+    """
+    if isinstance(values, LazySequence):
+        return values.size
+    return len(values)
+
+
+class LazySequence(Sequence):
+    """
+    A sequence whose size is known up front, but whose values are only computed when they are accessed.
+    """
+
+    @property
+    def size(self) -> int:
+        raise NotImplementedError
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def _check_index(self, index):
+        if isinstance(index, slice):
+            return None
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(f"{self.__class__.__name__} index out of range: {index}")
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get(i) for i in range(*index.indices(self.size))]
+        return self.get(self._check_index(index))
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self.get(index)
+
+    def get(self, index: int) -> str:
+        raise NotImplementedError
+
+
+class Expansion(LazySequence):
+    """
+    All the values a nested template (i.e. ``New York {city?}``) can expand to.  The size is the product of the size
+    of its grammars, and value `i` is rendered from the `i`-th combination of the template's combinator, so the values
+    come in the same order as rendering every combination up front would give.
+    """
+
+    def __init__(self, template: str, grammars: dict, rng=None):
+        from chatter.parser import TextParser
+
+        self.template = template
+        self.grammars = grammars
+        self.parser = TextParser(template, grammars, rng)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.template} size={self.size}>"
+
+    @property
+    def size(self) -> int:
+        return self.parser.combinator.count
+
+    def get(self, index: int) -> str:
+        return self.parser.process(self.parser.combinator.combination(index), self.grammars)
+
+
+def index_lines(buffer) -> tuple:
+    """
+    Find the lines of a file that hold a value (i.e. aren't blank).
+
+    :param buffer: The content of the file (i.e. a memory map)
+    :return: tuple - Two arrays, with the offset of the start and the end of every line
+    """
+    starts, ends = array('q'), array('q')
+    position, size = 0, len(buffer)
+    while position < size:
+        end = buffer.find(b'\n', position)
+        if end < 0:
+            end = size
+        if buffer[position:end].strip():
+            starts.append(position)
+            ends.append(end)
+        position = end + 1
+    return starts, ends
+
+
+class ValueFile(LazySequence):
+    """
+    The values of an external file, with one value per line, or a column of a csv file (that has a header row).  The
+    file is memory mapped and only the offsets of its lines are kept, so a value is read from the file when it's
+    accessed, and big value lists don't have to be loaded into memory.  Values are used as they are, they are not
+    expanded as templates.
+
+    Pickling keeps the index, and the file is mapped again when the values are unpickled.
+    """
+
+    def __init__(self, filename: str, column: str = None):
+        self.filename = os.path.abspath(filename)
+        self.column = column
+        if column is not None and not self.is_csv:
+            raise ValueError(f"Only csv files have columns: {self.filename}")
+        self.stat = None
+        self._open()
+
+    def __repr__(self):
+        column = f" column={self.column}" if self.column is not None else ""
+        return f"<{self.__class__.__name__} {self.filename}{column} size={self.size}>"
+
+    def __getstate__(self):
+        return dict(filename=self.filename, column=self.column, stat=self.stat, starts=self.starts, ends=self.ends,
+                    index=self.index)
+
+    def __setstate__(self, state):
+        self.filename = state['filename']
+        self.column = state['column']
+        self.stat = state['stat']
+        self.starts, self.ends, self.index = state['starts'], state['ends'], state['index']
+        self._open(reindex=False)
+
+    @property
+    def signature(self) -> str:
+        """
+        What identifies the values: the file, the column, and the modification time and size of the file.
+        """
+        return f"{self.filename}:{self.column}:{self.stat[0]}:{self.stat[1]}"
+
+    @property
+    def is_csv(self) -> bool:
+        return self.filename.lower().endswith('.csv')
+
+    def _open(self, reindex=True):
+        with open(self.filename, 'rb') as fp:
+            stat = os.fstat(fp.fileno())
+            # empty files can't be mapped
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if reindex or stat != self.stat:
+            self.stat = stat
+            self.starts, self.ends = index_lines(self.buffer)
+            self.index = self._find_column() if self.is_csv else None
+            if self.is_csv:
+                # the header row isn't a value
+                del self.starts[:1], self.ends[:1]
+
+    def _find_column(self) -> int:
+        if not self.starts:
+            raise ValueError(f"The csv file {self.filename} has no header row")
+        header = [name.strip().lstrip('\ufeff') for name in self._row(self.starts[0], self.ends[0])]
+        if self.column is None:
+            return 0
+        if self.column not in header:
+            raise ValueError(f"The csv file {self.filename} has no column {self.column!r}, only: {', '.join(header)}")
+        return header.index(self.column)
+
+    def _row(self, start: int, end: int) -> list:
+        return next(csv.reader([self.buffer[start:end].decode('utf-8')]))
+
+    @property
+    def size(self) -> int:
+        return len(self.starts)
+
+    def get(self, index: int) -> str:
+        start, end = self.starts[index], self.ends[index]
+        if self.index is None:
+            value = self.buffer[start:end].decode('utf-8')
+        else:
+            row = self._row(start, end)
+            value = row[self.index] if self.index < len(row) else ''
+        return " ".join(value.split())
+
+
+class Choices(LazySequence):
+    """
+    The values of a grammar.  Values are kept in segments: plain lists for values that are known up front, and lazy
+    sequences (i.e. big expansions, or the choices of another grammar) that are referenced rather than copied.
+    """
+
+    def __init__(self, values=None):
+        self.segments = []
+        self.offsets = []  # the index of the first value of each segment
+        self._size = 0
+        if values is not None:
+            self.extend(values)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} size={self._size} segments={len(self.segments)}>"
+
+    def __eq__(self, other):
+        if isinstance(other, (list, Choices)):
+            return size_of(other) == self._size and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def is_lazy(self) -> bool:
+        return any(not isinstance(segment, list) for segment in self.segments)
+
+    def _add_segment(self, segment):
+        self.segments.append(segment)
+        self.offsets.append(self._size)
+
+    def append(self, value: str):
+        if not self.segments or not isinstance(self.segments[-1], list):
+            self._add_segment([])
+        self.segments[-1].append(value)
+        self._size += 1
+
+    def extend(self, values):
+        """
+        Add values.  Lazy sequences that are too big to render up front are kept as a segment of their own.
+
+        :param values: A list or lazy sequence
+        :return: None
+        """
+        size = size_of(values)
+        if not size:
+            return
+
+        if isinstance(values, LazySequence) and size > MATERIALIZE_LIMIT:
+            self._add_segment(values)
+        else:
+            if not self.segments or not isinstance(self.segments[-1], list):
+                self._add_segment([])
+            self.segments[-1].extend(values)
+        self._size += size
+
+    def locate(self, index: int) -> tuple:
+        """
+        Find the segment that holds a value.
+
+        :param index: The index of the value
+        :return: tuple - The index of the segment, and the index of the value in that segment
+        """
+        segment = bisect_right(self.offsets, index) - 1
+        return segment, index - self.offsets[segment]
+
+    def get(self, index: int) -> str:
+        if len(self.segments) == 1:
+            return self.segments[0][index]
+
+        segment, index = self.locate(index)
+        return self.segments[segment][index]
+
+    def __iter__(self):
+        for segment in self.segments:
+            yield from segment
@@ -21,6 +21,7 @@ import click
 import logging
 
 from chatter.commands.generate import generate
+from chatter.commands.stats import stats
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG, format='%(asctime)s %(message)s')
 
@@ -37,3 +38,4 @@ def cli(ctx, verbose):
 
 
 cli.add_command(generate)
+cli.add_command(stats)
@@ -1,18 +1,22 @@
-import itertools
 import logging
 import random
+from bisect import bisect_right
 from random import SystemRandom
 
+from chatter.utils.permutation import Permutation, decode_mixed_radix, encode_mixed_radix
+
 logger = logging.getLogger(__name__)
 cryptorand = SystemRandom()
 
 
 class Combinator:
-    def __init__(self, placeholders: list):
-        self.used = []
+    def __init__(self, placeholders: list, rng: random.Random = None):
         self.count = 1
         self.placeholders = placeholders
-        self.comb_values = []
+        self.random = rng or random.Random()
+        self.radices = []
+        self.position = 0
+        self.permutation: Permutation = None
 
         self.reset_combinations()
 
@@ -21,49 +25,151 @@ class Combinator:
     ################################################################################
     def reset_combinations(self):
         """
-        Rebuild the possible combinations, and make them available
+        Rebuild the possible combinations, and make them available.  An optional placeholder has one more index than
+        its grammar has choices: the last index leaves it out.
 
         :return: None
         """
-        self.comb_values = []
+        self.radices = [p.index_range + 1 if p.optional else p.index_range for p in self.placeholders]
         self.count = 1
-        for p in self.placeholders:
-            self.comb_values.append(list(range(p.index_range)))
-            self.count = self.count * p.index_range
+        for radix in self.radices:
+            self.count = self.count * radix
+        self.position = 0
+        self.handed_out = 0
+        self.front = []
+        self.front_values = set()
+        self.front_gaps = []
+        self.permutation = Permutation(self.count, self.random)
 
-    def get(self):
+    @property
+    def available(self) -> int:
+        """
+        The number of combinations that have not been handed out yet
         """
-        Pick an unused combination by poping it off the top of the stack
+        return self.count - self.handed_out
 
+    def combination(self, position: int) -> list:
+        """
+        Get the combination at `position` in this combinator's (pseudo random) order.
+
+        :param position: The position in the permutation, from 0 to count - 1
         :return: list - The list of combination indexes
         """
-        if len(self.used) == self.count:
+        return decode_mixed_radix(self.permutation[position], self.radices)
+
+    def set_front(self, combinations: list):
+        """
+        Hand out some combinations before all the others (i.e. to cover every priority value early on).  The rest
+        of the combinations still come from the permutation, which skips the ones that were handed out up front.
+
+        :param combinations: The combinations, they must be unique
+        :return: None
+        """
+        if self.handed_out:
+            raise RuntimeError("The combinations to hand out first must be set before any are handed out")
+        self.front = [list(combination) for combination in combinations]
+        self.front_values = set(encode_mixed_radix(combination, self.radices) for combination in self.front)
+        # where the skipped values are in the permutation, less the number of skipped values before them, so the
+        # position of the n-th value that isn't skipped is n plus the number of gaps up to n (see `handed`)
+        positions = sorted(self.permutation.index(value) for value in self.front_values)
+        self.front_gaps = [position - rank for rank, position in enumerate(positions)]
+
+    def get(self):
+        """
+        Pick an unused combination.  Each call walks one step further along a random permutation of all the
+        combinations, so every combination is returned exactly once, in constant time and memory.
+
+        :return: list - The list of combination indexes, or None if all combinations have been used
+        """
+        if self.handed_out >= self.count:
             return None
 
-        miss_count = 0
-        while True:
-            combination = [random.randint(0, p.index_range - 1) for p in self.placeholders]
-            key = tuple(combination)
-            if key not in self.used:
-                self.used.append(key)
-                return combination
-            else:
-                miss_count += 1
-                if miss_count >= 3:
-                    for combo in itertools.product(*self.comb_values):
-                        if combo not in self.used:
-                            self.used.append(combo)
-                            return combo
+        if self.handed_out < len(self.front):
+            combination = self.front[self.handed_out]
+        else:
+            value = self.permutation[self.position]
+            self.position += 1
+            while value in self.front_values:
+                value = self.permutation[self.position]
+                self.position += 1
+            combination = decode_mixed_radix(value, self.radices)
+        self.handed_out += 1
+        return combination
+
+    def handed(self, index: int) -> list:
+        """
+        Get the combination that is handed out at `index`, the same one that the `index + 1`-th call to `get` returns.
+        Once every combination has been handed out, they are handed out again in the same order, so any index has a
+        combination.  Unlike `get`, this takes constant time for any index, so the combinations don't have to be
+        handed out in order.
+
+        :param index: The index
+        :return: list - The list of combination indexes
+        """
+        index %= self.count
+        if index < len(self.front):
+            return list(self.front[index])
+        index -= len(self.front)
+        return self.combination(index + bisect_right(self.front_gaps, index))
+
+    def handed_batch(self, indexes):
+        """
+        Get the combinations that are handed out at many indexes at once, see `handed`.  Requires NumPy.
+
+        :param indexes: The indexes
+        :return: numpy.ndarray - A matrix with one combination per row
+        """
+        from chatter.utils import batch
+
+        np = batch.import_numpy()
+        if not batch.fits(self.permutation):
+            matrix = np.empty((len(indexes), len(self.radices)), dtype=object)
+            for row, index in enumerate(indexes):
+                matrix[row] = self.handed(int(index))
+            return matrix
+
+        indexes = np.asarray(indexes, dtype=np.uint64) % np.uint64(self.count)
+        matrix = np.empty((len(indexes), len(self.radices)), dtype=np.uint64)
+
+        front = indexes < np.uint64(len(self.front))
+        if front.any():
+            matrix[front] = np.array(self.front, dtype=np.uint64)[indexes[front].astype(np.intp)]
+
+        rest = indexes[~front] - np.uint64(len(self.front))
+        if self.front_gaps:
+            gaps = np.searchsorted(np.array(self.front_gaps, dtype=np.uint64), rest, side='right')
+            rest = rest + gaps.astype(np.uint64)
+        matrix[~front] = batch.combinations(self, rest)
+        return matrix
+
+    def _used_position(self) -> int:
+        # the combinations before `position` have all been handed out, either from the permutation or up front
+        return self.random.randrange(self.position)
 
     def get_used(self):
         """
-        Randomly pick from the "used" list.
+        Randomly pick from the combinations that have already been handed out.
 
         :return: list - The list of combination indexes
         """
-        if self.used:
-            key = random.choice(self.used)
-            return list(key)
+        if self.position:
+            return self.combination(self._used_position())
+        if self.handed_out:
+            # only the combinations that were handed out up front have been used
+            return list(self.front[self.random.randrange(self.handed_out)])
+
+    def optional_mask(self, combination: list) -> int:
+        """
+        Get the optional placeholders that a combination leaves out.
+
+        :param combination: The list of combination indexes
+        :return: int - A bit mask, where bit `i` is set if placeholder `i` is left out
+        """
+        mask = 0
+        for index, p in enumerate(self.placeholders):
+            if p.optional and combination[index] == p.index_range:
+                mask |= 1 << index
+        return mask
 
     def get_min_combinations(self):
         """
@@ -71,7 +177,7 @@ class Combinator:
 
         :return: int - The minimum number of combination to get a fair representation
         """
-        total = sum([p.index_range for p in self.placeholders if p.priority])
+        total = sum([radix for p, radix in zip(self.placeholders, self.radices) if p.priority])
         if not total:
             return 1
         return total
@@ -79,34 +185,42 @@ class Combinator:
     def ensure_priorities(self, num):
         """
         Ensure that ALL possible values of priority placeholders are represented by the first `num` combinations.
+        The first combinations of the permutation are handed out up front, with their priority placeholders changed
+        so that together they hold every value (the same as a covering array of strength 1).
 
         :param num: The number of combinations requested.
         :return: None
         """
-        # available_combinations = self.available
-        # for priority_index, p in enumerate(self.placeholders):
-        #     if p.priority:
-        #
-        #         existing = set([x[priority_index] for x in available_combinations[:num]])
-        #         possible = set(range(p.index_range))
-        #         missing = possible - existing
-        #         logger.debug(f"  Missing: {missing} == {possible} - {existing}")
-        #         if not missing:
-        #             continue
-        #
-        #         move_list = []
-        #         table_index = len(available_combinations) - 1
-        #         while missing:
-        #             if available_combinations[table_index][priority_index] in missing:
-        #                 move_list.append(available_combinations[table_index])
-        #                 missing.remove(available_combinations[table_index][priority_index])
-        #             table_index -= 1
-        #             if table_index <= 0:
-        #                 raise RuntimeError(f"Unable to find all combinations of priorty grammar {p.name}")
-        #
-        #         for combination in move_list:
-        #             logger.debug(f"Moving: {p.name}:{priority_index} - {combination}")
-        #             available_combinations.insert(0, available_combinations.pop(available_combinations.index(combination)))
-        #
-        #         self.available = available_combinations
-        pass
+        if self.front or self.handed_out:
+            return
+
+        priorities = [index for index, p in enumerate(self.placeholders) if p.priority]
+        if not priorities or not self.count:
+            return
+
+        # the biggest priority placeholder takes a different value in every row, so the rows are all unique
+        rows = max(self.radices[index] for index in priorities)
+        if num < rows:
+            logger.warning(f"Only {num} combinations requested, but {rows} are needed to cover every priority value")
+
+        front = []
+        for position in range(rows):
+            combination = self.combination(position)
+            for index in priorities:
+                combination[index] = position % self.radices[index]
+            front.append(combination)
+        self.set_front(front)
+
+    def ensure_coverage(self, strength: int):
+        """
+        Hand out a covering array first, so every combination of values of any `strength` placeholders is in the
+        first combinations (see `chatter.utils.coverage.covering_array`).  This also covers every priority value.
+
+        :param strength: The number of placeholders whose values are covered together (2 for pairwise)
+        :return: int - The number of combinations in the covering array
+        """
+        from chatter.utils.coverage import covering_array
+
+        if not self.front:
+            self.set_front(covering_array(self.radices, strength))
+        return len(self.front)
@@ -1,13 +1,89 @@
+import logging
+import sys
+
 import click
 from click import secho
 
+from chatter.config import DEFAULT_CONFIG, load_config
+from chatter.dedup import parse_dedup
 from chatter.loader import RasaNLULoader
+from chatter.utils.coverage import parse_coverage
+from chatter.utils.shard import parse_shard
+
+
+def validate_shard(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+
+def validate_coverage(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_coverage(value)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+
+def validate_dedup(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_dedup(value)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+
+def make_loader(*args, **kwargs) -> RasaNLULoader:
+    try:
+        return RasaNLULoader(*args, **kwargs)
+    except ValueError as err:
+        raise click.UsageError(str(err))
+
+
+def dedup_options(command):
+    """
+    Add the options that drop duplicate examples to a command.
+    """
+    command = click.option('--dedup-scope', default='global', type=click.Choice(['global', 'intent']),
+                           help="Drop the duplicates across all intents (needs a single job), or within each "
+                                "intent.  With --shard, duplicates are only dropped within the shard")(command)
+    command = click.option('--dedup', default=None, callback=validate_dedup,
+                           help="Drop examples whose text was already generated, remembering every text (exact) "
+                                "or with a fixed size filter for N texts (bloom or bloom=N)")(command)
+    return command
+
+
+def get_seed(ctx, seed):
+    """
+    Use the seed given on the command line, or fall back to the `generation_seed` of the configuration.
+    """
+    if seed is None:
+        seed = ctx.obj['config'].get('generation_seed')
+    return seed
+
+
+def log_to_stderr():
+    """
+    Move the log output that goes to stdout over to stderr, so it doesn't end up in output that is piped.
+    """
+    for handler in logging.getLogger().handlers:
+        if getattr(handler, 'stream', None) is sys.stdout:
+            handler.flush()
+            handler.stream = sys.stderr
 
 
 @click.group()
+@click.option('--config', 'config_file', default=DEFAULT_CONFIG, type=click.Path(dir_okay=False),
+              help="The configuration file to read settings (i.e. generation_seed) from")
 @click.pass_context
-def generate(ctx):
-    pass
+def generate(ctx, config_file):
+    ctx.ensure_object(dict)
+    ctx.obj['config'] = load_config(config_file)
 
 
 @generate.group('rasa')
@@ -18,21 +94,73 @@ def rasa_group(ctx):
 
 @generate.command('sentences')
 @click.argument('filename', type=click.Path(exists=True))
-@click.argument('outfile', default='sentences.txt', type=click.Path(exists=False))
+@click.argument('outfile', default='sentences.txt', type=click.Path(exists=False, allow_dash=True))
 @click.option('--num', default=0)
-def load_sentences(filename, outfile, num):
-    click.secho(f"Generating sentences for {filename}", fg='green')
+@click.option('--jobs', default=1, help="The number of processes to generate with (0 for one per CPU)")
+@click.option('--seed', default=None, type=int, help="Seed the generation, to get the same output on every run")
+@click.option('--shard', default=None, callback=validate_shard, help="Only generate shard i of N (i.e. 2/4)")
+@click.option('--cache-dir', default=None, type=click.Path(file_okay=False),
+              help="Keep compiled intents in this directory, so unchanged intents load faster on the next run")
+@click.option('--coverage', default=None, callback=validate_coverage,
+              help="Generate a covering array of each template instead of random examples, either pairwise or t=N "
+                   "(--num is ignored)")
+@click.option('--exhaustive', is_flag=True,
+              help="Generate every combination of every template once, in order (--num is ignored)")
+@dedup_options
+@click.pass_context
+def load_sentences(ctx, filename, outfile, num, jobs, seed, shard, cache_dir, coverage, exhaustive, dedup,
+                   dedup_scope):
+    """
+    Write the text of the generated examples to OUTFILE (or to stdout, if OUTFILE is -), one sentence per line.
+    """
+    to_stdout = outfile == '-'
+    if to_stdout:
+        log_to_stderr()
+    click.secho(f"Generating sentences for {filename}", fg='green', err=to_stdout)
 
-    loader = RasaNLULoader(num)
-    click.secho(f"Loading...", fg='green')
+    loader = make_loader(num, streaming=True, jobs=jobs, seed=get_seed(ctx, seed), shard=shard, cache_dir=cache_dir,
+                         coverage=coverage, dedup=dedup, dedup_scope=dedup_scope, exhaustive=exhaustive)
+    click.secho(f"Loading...", fg='green', err=to_stdout)
+    loader.load(filename)
+
+    secho(f"  Generating sentences...\n", fg="green", err=to_stdout)
+    if to_stdout:
+        with click.open_file(outfile, 'w') as fp:
+            loader.export_sentences(fp)
+    else:
+        loader.export_sentences(outfile)
+
+    if dedup is not None:
+        secho(f"Dropped {loader.duplicates} duplicate sentences", fg="green", err=to_stdout)
+
+
+@generate.command('corpus')
+@click.argument('filename', type=click.Path(exists=True))
+@click.argument('outfile', default='corpus.bin', type=click.Path(exists=False))
+@click.option('--num', default=0)
+@click.option('--seed', default=None, type=int, help="Seed the generation, to get the same output on every run")
+@click.option('--cache-dir', default=None, type=click.Path(file_okay=False),
+              help="Keep compiled intents in this directory, so unchanged intents load faster on the next run")
+@click.option('--coverage', default=None, callback=validate_coverage,
+              help="Generate a covering array of each template instead of random examples, either pairwise or t=N "
+                   "(--num is ignored)")
+@click.option('--exhaustive', is_flag=True,
+              help="Generate every combination of every template once, in order (--num is ignored)")
+@click.pass_context
+def load_corpus(ctx, filename, outfile, num, seed, cache_dir, coverage, exhaustive):
+    """
+    Write the generated examples to OUTFILE as compact combination records, that can be rendered on demand with
+    `chatter.corpus.Corpus`.
+    """
+    click.secho(f"Generating a corpus for {filename}", fg='green')
+
+    loader = make_loader(num, streaming=True, seed=get_seed(ctx, seed), cache_dir=cache_dir, coverage=coverage,
+                         exhaustive=exhaustive)
+    click.secho("Loading...", fg='green')
     loader.load(filename)
 
-    for intent in loader.intents.values():
-        secho(f"  Generating sentences...\n", fg="green")
-        with open(outfile, 'w') as fp:
-            with click.progressbar(intent.training_examples, label="Generating...") as bar:
-                for example in bar:
-                    fp.write(example.text + "\n")
+    count = loader.export_corpus(outfile)
+    click.secho(f"Wrote {count} examples to {outfile}", fg='green')
 
 
 @rasa_group.command('nlu')
@@ -41,14 +169,30 @@ def load_sentences(filename, outfile, num):
 @click.argument('testdir', default='tests/test_data', type=click.Path(dir_okay=True))
 @click.option('--num', default=0)
 @click.option('--test-ratio', default=20)
-def load_nlu(filename, outdir, testdir, num, test_ratio):
+@click.option('--jobs', default=1, help="The number of processes to generate with (0 for one per CPU)")
+@click.option('--seed', default=None, type=int, help="Seed the generation, to get the same output on every run")
+@click.option('--shard', default=None, callback=validate_shard, help="Only generate shard i of N (i.e. 2/4)")
+@click.option('--cache-dir', default=None, type=click.Path(file_okay=False),
+              help="Keep compiled intents in this directory, so unchanged intents load faster on the next run")
+@click.option('--coverage', default=None, callback=validate_coverage,
+              help="Generate a covering array of each template instead of random examples, either pairwise or t=N "
+                   "(--num is ignored)")
+@click.option('--exhaustive', is_flag=True,
+              help="Generate every combination of every template once, in order (--num is ignored)")
+@dedup_options
+@click.pass_context
+def load_nlu(ctx, filename, outdir, testdir, num, test_ratio, jobs, seed, shard, cache_dir, coverage, exhaustive,
+             dedup, dedup_scope):
     click.secho(f"Generating RASA NLU data for {filename}", fg='green')
 
-    loader = RasaNLULoader(num, test_ratio)
+    loader = make_loader(num, test_ratio, streaming=True, jobs=jobs, seed=get_seed(ctx, seed), shard=shard,
+                         cache_dir=cache_dir, coverage=coverage, dedup=dedup, dedup_scope=dedup_scope,
+                         exhaustive=exhaustive)
     click.secho(f"Loading...", fg='green')
     loader.load(filename)
 
-    click.secho(f"Saving training data", fg='green')
-    loader.save(outdir)
-    click.secho(f"Saving testing data", fg='green')
-    loader.save_tests(testdir)
+    click.secho(f"Saving training and testing data", fg='green')
+    loader.export(outdir, testdir)
+
+    if dedup is not None:
+        click.secho(f"Dropped {loader.duplicates} duplicate examples", fg='green')
@@ -0,0 +1,55 @@
+import click
+from tabulate import tabulate
+
+from chatter.choices import size_of
+from chatter.loader import RasaNLULoader
+
+
+def intent_rows(intents) -> list:
+    return [
+        [intent.name, len(intent.text_parsers), intent.get_possible_combination_count(),
+         intent.get_min_combinations()]
+        for intent in intents
+    ]
+
+
+def template_rows(intents) -> list:
+    rows = []
+    for intent in intents:
+        for parser in intent.text_parsers:
+            priorities = [f"{p.name} ({p.index_range})" for p in parser.placeholders if p.priority]
+            rows.append([intent.name, parser.text, len(parser.placeholders), parser.possible_combinations,
+                         ", ".join(priorities)])
+    return rows
+
+
+def grammar_rows(intents) -> list:
+    rows = []
+    for intent in intents:
+        for name, grammar in intent.grammars.items():
+            rows.append([intent.name, name, 'entity' if grammar.is_entity else 'grammar', size_of(grammar.choices),
+                         len(grammar.synonyms)])
+    return rows
+
+
+@click.command('stats')
+@click.argument('filename', type=click.Path(exists=True))
+@click.option('--cache-dir', default=None, type=click.Path(file_okay=False),
+              help="Keep compiled intents in this directory, so unchanged intents load faster on the next run")
+def stats(filename, cache_dir):
+    """
+    Show how many examples the intents can generate, without generating any.
+    """
+    loader = RasaNLULoader(streaming=True, cache_dir=cache_dir)
+    loader.load(filename)
+    intents = list(loader.iter_intents())
+
+    click.secho("Intents", fg='green')
+    click.echo(tabulate(intent_rows(intents), headers=['Intent', 'Templates', 'Combinations', 'Minimum']))
+
+    click.secho("\nTemplates", fg='green')
+    click.echo(tabulate(template_rows(intents), headers=[
+        'Intent', 'Template', 'Placeholders', 'Combinations', 'Priority placeholders']))
+
+    click.secho("\nGrammars", fg='green')
+    click.echo(tabulate(grammar_rows(intents), headers=['Intent', 'Grammar', 'Type', 'Choices', 'Synonyms']))
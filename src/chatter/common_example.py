@@ -1,25 +1,30 @@
 import logging
-from collections import defaultdict
+
+from chatter.entity import Entity
 
 logger = logging.getLogger(__name__)
 
 
 class CommonExample:
+    """
+    A generated example.  Only its text, its entities and the names of the synonyms it uses are kept (everything
+    else is held once by the intent), and the output is built when it's asked for, so examples stay small.
+    """
+    __slots__ = ('parent', 'text', 'spans', 'synonym_names')
+
     def __init__(self, parent=None):
         self.parent = parent
         self.text = None
+        self.spans = ()  # an `Entity` for each entity in the text
+        self.synonym_names = ()  # the synonyms are kept (once) by the intent, see `RasaNLUIntent.use_synonym`
 
-        self.entities = []
-        self.grammars = []
-        self.synonyms_used = defaultdict(list)
-        self.combination: list = []
-        self.picker = None
-        self.grammar_values = None
-        self.placeholders = []
+    @property
+    def entities(self) -> list:
+        return [span.to_example() for span in self.spans]
 
     @property
     def synonyms(self):
-        return {name: list(value) for name, value in self.synonyms_used.items()}
+        return {name: self.parent.synonyms_used[name] for name in self.synonym_names}
 
     def to_dict(self) -> dict:
         return dict(
@@ -28,29 +33,53 @@ class CommonExample:
             entities=self.entities
         )
 
-    def process_synonyms(self, placeholder, entity):
-        if placeholder.synonym:
-            # instead of usng a set(), do this to preserve order
-            if placeholder.synonym in entity.synonyms:
-                for n in entity.synonyms[placeholder.synonym]:
-                    if n not in self.synonyms_used[placeholder.synonym]:
-                        self.synonyms_used[placeholder.synonym].append(n)
-            elif placeholder.synonym in self.parent.grammars:
-                for n in self.parent.grammars[placeholder.synonym].choices:
-                    if n not in self.synonyms_used[placeholder.synonym]:
-                        self.synonyms_used[placeholder.synonym].append(n)
+    def process_synonyms(self, span, entity):
+        """
+        Record the synonym that a placeholder's value belongs to with the intent.
+
+        :param span: The `chatter.parser.Span` of an entity
+        :param entity: The entity's grammar
+        :return: str - The name of the synonym, or None if the value isn't a synonym
+        """
+        name = span.synonym
+        if not name:
+            return None
+
+        if name in entity.synonyms:
+            values = entity.synonyms[name]
+        elif name in self.parent.grammars:
+            values = self.parent.grammars[name].choices
+        else:
+            values = None
+
+        if not values:
+            return None
+        self.parent.use_synonym(name, values, span.value)
+        return name
 
     def process(self, parser, combination):
-        self.text = parser.process(combination, self.parent.grammars)
+        self.process_rendering(parser.render(combination, self.parent.grammars))
+
+    def process_rendering(self, rendering):
+        """
+        Fill in the example from the rendering of a combination.
+
+        :param rendering: The `Rendering` of the example's text
+        :return: None
+        """
+        self.text = rendering.text
 
-        for index, name in enumerate(parser.names):
-            placeholder = parser.placeholders[index]
+        spans = []
+        synonym_names = []
+        for span in rendering.spans:
+            if span.name in self.parent.entities:
+                synonym = self.process_synonyms(span, self.parent.entities[span.name])
+                if synonym is not None:
+                    synonym_names.append(synonym)
 
-            if name in self.parent.entities:
-                entity = self.parent.entities[name]
-                self.process_synonyms(placeholder, entity)
+                if span.synonym or span.value:
+                    spans.append(Entity(span.name, span.value, span.synonym or span.value, span.start, span.end))
 
-                if placeholder.synonym or placeholder.value:
-                    self.entities.append(
-                        dict(start=placeholder.start, end=placeholder.end,
-                             value=placeholder.synonym or placeholder.value, entity=name))
+        # empty tuples are shared, so examples without entities don't hold any lists
+        self.spans = tuple(spans)
+        self.synonym_names = tuple(synonym_names)
@@ -0,0 +1,24 @@
+import logging
+import os
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = 'config.yml'
+
+
+def load_config(filename=DEFAULT_CONFIG) -> dict:
+    """
+    Load the project configuration (see ``config.yml``).
+
+    :param filename: The configuration file
+    :return: dict - The configuration, or an empty dict if there is no configuration file
+    """
+    if not filename or not os.path.exists(filename):
+        return {}
+
+    with open(filename, 'r') as fp:
+        config = yaml.safe_load(fp) or {}
+    logger.debug(f"Loaded configuration from {filename}")
+    return config
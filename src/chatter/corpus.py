@@ -0,0 +1,189 @@
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from collections.abc import Sequence
+
+from chatter.common_example import CommonExample
+from chatter.utils.files import replace_file
+from chatter.utils.permutation import decode_mixed_radix, encode_mixed_radix
+from chatter.writer import BUFFER_SIZE
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CHATTER-CORPUS\n\0'
+VERSION = 2
+
+# magic, version and the length of the pickled header that follows
+PREAMBLE = struct.Struct('<16sIQ')
+TEMPLATE_ID = struct.Struct('<I')
+
+
+def _byte_width(value: int) -> int:
+    return max(1, (value.bit_length() + 7) // 8)
+
+
+class CorpusWriter:
+    """
+    Writes examples as packed combination records, rather than as rendered text.
+
+    An example is fully determined by its template and its combination (which includes the optional placeholders
+    that are left out), so that is all that is stored: each record is the template id, and the combination encoded
+    as a single mixed-radix number.  The records have a fixed size, and are preceded by a header that holds the
+    compiled intents, so any record can be rendered again with `Corpus`.
+    """
+
+    def __init__(self, filename, intents: list, buffer_size: int = BUFFER_SIZE):
+        self.filename = filename
+        self.intents = intents
+        self.buffer_size = buffer_size
+        self.count = 0
+        self.fp = None
+        self.tmp_filename = None
+
+        self.templates = []  # (intent index, parser index) of each template id
+        self.template_ids = {}
+        value_width = 0
+        for intent_index, intent in enumerate(intents):
+            for parser_index, parser in enumerate(intent.text_parsers):
+                self.template_ids[id(parser)] = len(self.templates)
+                self.templates.append((intent_index, parser_index))
+                value_width = max(value_width, _byte_width(parser.combinator.count - 1))
+        self.value_width = value_width
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.discard()
+        elif not self.closed:
+            self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.fp is None or self.fp.closed
+
+    def open(self):
+        # the intents haven't generated anything yet, so the header holds them just as they were compiled
+        header = pickle.dumps(dict(
+            intents=self.intents,
+            templates=self.templates,
+            value_width=self.value_width,
+        ), pickle.HIGHEST_PROTOCOL)
+
+        dirname, basename = os.path.split(os.path.abspath(self.filename))
+        fd, self.tmp_filename = tempfile.mkstemp(prefix=f".{basename}.", dir=dirname)
+        self.fp = open(fd, 'wb', buffering=self.buffer_size)
+        self.fp.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        self.fp.write(header)
+        return self
+
+    def write(self, parser, combination: list):
+        """
+        Write a single example.
+
+        :param parser: The parser of the example's template (of one of the intents the writer was created with)
+        :param combination: The example's combination
+        :return: None
+        """
+        value = encode_mixed_radix(combination, parser.combinator.radices)
+
+        self.fp.write(TEMPLATE_ID.pack(self.template_ids[id(parser)]))
+        self.fp.write(value.to_bytes(self.value_width, 'little'))
+        self.count += 1
+
+    def close(self):
+        self.fp.close()
+        replace_file(self.tmp_filename, self.filename)
+        logger.debug(f"Wrote {self.count} examples to {self.filename}")
+
+    def discard(self):
+        if not self.closed:
+            self.fp.close()
+        if self.tmp_filename is not None and os.path.exists(self.tmp_filename):
+            os.remove(self.tmp_filename)
+
+
+class Corpus(Sequence):
+    """
+    Reads a file written by `CorpusWriter`.  The records are memory mapped, and only rendered into examples when they
+    are accessed, so any slice of even a huge corpus can be read quickly.
+
+    The header is unpickled, so only open corpora from a trusted source.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_size = PREAMBLE.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a chatter corpus")
+        if version != VERSION:
+            raise ValueError(f"{filename} is a version {version} corpus, only version {VERSION} is supported")
+
+        header = pickle.loads(self.mmap[PREAMBLE.size:PREAMBLE.size + header_size])
+        self.intents = header['intents']
+        self.templates = [self.intents[i].text_parsers[j] for i, j in header['templates']]
+        self.template_intents = [self.intents[i] for i, _ in header['templates']]
+        self.value_width = header['value_width']
+
+        self.offset = PREAMBLE.size + header_size
+        self.record_size = TEMPLATE_ID.size + self.value_width
+        self.count = (len(self.mmap) - self.offset) // self.record_size
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.filename} count={self.count}>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.mmap.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.example(i) for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(f"{self.__class__.__name__} index out of range: {index}")
+        return self.example(index)
+
+    def record(self, index: int) -> tuple:
+        """
+        Read a record.
+
+        :param index: The index of the record
+        :return: tuple - The template id, the combination, and the bit mask of the optional placeholders it leaves out
+        """
+        start = self.offset + index * self.record_size
+        template_id, = TEMPLATE_ID.unpack_from(self.mmap, start)
+        start += TEMPLATE_ID.size
+        value = int.from_bytes(self.mmap[start:start + self.value_width], 'little')
+
+        parser = self.templates[template_id]
+        combination = decode_mixed_radix(value, parser.combinator.radices)
+        return template_id, combination, parser.combinator.optional_mask(combination)
+
+    def example(self, index: int) -> CommonExample:
+        """
+        Render a record into an example.
+
+        :param index: The index of the record
+        :return: CommonExample - The example, with its text and entities
+        """
+        template_id, combination, _ = self.record(index)
+        example = CommonExample(self.template_intents[template_id])
+        example.process(self.templates[template_id], combination)
+        return example
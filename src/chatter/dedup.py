@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# the number of texts a bloom filter is sized for when none is given, and its false positive rate once it's full
+DEFAULT_CAPACITY = 10 ** 7
+ERROR_RATE = 0.001
+
+
+def parse_dedup(value: str) -> tuple:
+    """
+    Parse a duplicate filter specification, either ``exact``, ``bloom`` or ``bloom=N`` (a bloom filter sized for N
+    texts).
+
+    :param value: The specification
+    :return: tuple - The mode, and the capacity of the filter (None for exact filters)
+    """
+    value = value.strip().lower()
+    if value == 'exact':
+        return 'exact', None
+
+    mode, _, capacity = value.partition('=')
+    if mode.strip() == 'bloom':
+        if not capacity:
+            return 'bloom', DEFAULT_CAPACITY
+        if capacity.strip().isdigit() and int(capacity) > 0:
+            return 'bloom', int(capacity)
+    raise ValueError(f"Invalid duplicate filter {value!r}, use exact, bloom or bloom=N (with N of at least 1)")
+
+
+def make_filter(spec: tuple):
+    """
+    Create an empty duplicate filter.
+
+    :param spec: The mode and capacity, see `parse_dedup`
+    :return: ExactFilter or BloomFilter - The filter
+    """
+    mode, capacity = spec
+    if mode == 'exact':
+        return ExactFilter()
+    return BloomFilter(capacity)
+
+
+class ExactFilter:
+    """
+    Remembers every text it's given, so it never drops a text by mistake.  Memory grows with the number of unique
+    texts.
+    """
+
+    def __init__(self):
+        self.texts = set()
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __contains__(self, text):
+        return text in self.texts
+
+    def add(self, text: str) -> bool:
+        """
+        Add a text to the filter.
+
+        :param text: The text
+        :return: bool - True if the text is new, False if it's a duplicate
+        """
+        if text in self.texts:
+            self.rejected += 1
+            return False
+        self.texts.add(text)
+        return True
+
+
+class BloomFilter:
+    """
+    A bloom filter of a fixed size, for runs that are too big to remember every text.  It never lets a duplicate
+    through, but it drops a small fraction of the unique texts as well: about `error_rate` of them once it holds
+    `capacity` texts, and more after that.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, error_rate: float = ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, text: str) -> list:
+        # double hashing: the positions are h1 + i * h2, with both halves of a single 128 bit hash
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, text):
+        return all(self.bits[position >> 3] & 1 << (position & 7) for position in self._positions(text))
+
+    def add(self, text: str) -> bool:
+        """
+        Add a text to the filter.
+
+        :param text: The text
+        :return: bool - True if the text is new, False if it's (most likely) a duplicate
+        """
+        bits = self.bits
+        new = False
+        for position in self._positions(text):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                new = True
+
+        if not new:
+            self.rejected += 1
+            return False
+        self.count += 1
+        if self.count == self.capacity + 1:
+            logger.warning(f"The duplicate filter is full ({self.capacity} texts), it will drop more unique texts")
+        return True
@@ -4,6 +4,12 @@ logger = logging.getLogger(__name__)
 
 
 class Entity:
+    """
+    An entity of an example: where it is in the text, and the value it's exported with.  There is one for every
+    entity of every example, so it only has slots.
+    """
+    __slots__ = ('name', 'value', 'entity_value', 'start', 'end')
+
     def __init__(self, name, value, entity_value, start, end):
         self.value = value
         self.entity_value = entity_value
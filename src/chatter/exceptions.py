@@ -20,3 +20,9 @@ class PlaceholderError(Exception):
 
     def __str__(self):
         return f"Unable to find grammar for {self.grammar_name}/{self.placeholder_text} in filename: {self.filename}"
+
+
+class CycleError(GrammarError):
+    def __init__(self, cycle: list):
+        self.cycle = cycle
+        super().__init__(f"Grammars reference each other in a cycle: {' -> '.join(cycle)}")
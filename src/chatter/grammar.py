@@ -1,35 +1,86 @@
 import logging
 import random
+import sys
 from collections import defaultdict, OrderedDict
 
-from chatter.parser import PATTERN_RESERVED_CHARS
-from chatter.placeholder import get_all_possible_values
+from chatter.choices import MATERIALIZE_LIMIT, Choices, Expansion, LazySequence, size_of
+from chatter.parser import PATTERN_RESERVED_CHARS, normalize_whitespace
+from chatter.utils.regex import REPLACEMENT_PATTERN
+from chatter.utils.seed import derive_random
 
 logger = logging.getLogger(__name__)
 
 
-def process_template(template, grammars):
-    values = []
+def process_template(template, grammars, rng=None):
+    """
+    Get all the values a template can expand to.  Big expansions are not rendered, but returned as a lazy sequence
+    that renders each value when it's accessed.
+
+    :param template: The template text
+    :param grammars: The grammars that the template's placeholders refer to
+    :param rng: The random stream of the template
+    :return: list or Expansion - The values
+    """
     if '{' in template:
-        all_values = get_all_possible_values(template, grammars)
-        values.extend(all_values)
-    else:
-        values.append(template)
-    return values
+        values = Expansion(template, grammars, rng)
+        if values.size <= MATERIALIZE_LIMIT:
+            return [sys.intern(value) for value in values]
+        return values
+    return [sys.intern(normalize_whitespace(template))]
+
+
+def get_references(data, references=None) -> OrderedDict:
+    """
+    Find the grammars that a grammar's yaml data refers to, without loading it.
+
+    :param data: The yaml data
+    :param references: The dict to add the references to
+    :return: OrderedDict - The name of every grammar referred to -> the first template that refers to it
+    """
+    if references is None:
+        references = OrderedDict()
+
+    if isinstance(data, str):
+        for pattern in REPLACEMENT_PATTERN.findall(data):
+            references.setdefault(pattern.strip(PATTERN_RESERVED_CHARS), data)
+    elif isinstance(data, (OrderedDict, dict)):
+        # the keys are synonym names, only the values can refer to grammars
+        for value in data.values():
+            get_references(value, references)
+    elif isinstance(data, list):
+        for value in data:
+            get_references(value, references)
+    return references
 
 
 class Grammar:
-    def __init__(self, name, intent=None, is_entity=False):
+    def __init__(self, name, intent=None, is_entity=False, grammars: dict = None, seed=None):
         self.name = name
+        self.key = None  # set by the `GrammarLibrary` that holds this grammar
         self.value = None  # The value chosen
         self.entity_value = None  # value that is exported to the json file
-        self.choices = []  # List of values to choose from
-        self.synonyms = defaultdict(list)
+        self.choices = Choices()  # List of values to choose from
+        self.synonyms = defaultdict(Choices)
         self.used_synonyms = []
+        self.synonym_index = {}  # value -> the name of the first synonym it belongs to
+        self.segment_synonyms = []  # the synonym name of each lazy segment of the choices
         self.intent = intent
         self.is_entity = is_entity
+        # the grammars that the templates refer to, and the seed they are expanded with
+        self.grammars = grammars if grammars is not None else getattr(intent, 'grammars', {})
+        self.seed = seed
 
     def load_data(self, data=None):
+        """
+        Load the choices and synonyms of this grammar from its yaml data, and index the synonyms.
+
+        :param data: The yaml data
+        :return: None
+        """
+        self._load_data(data)
+        self.index_synonyms()
+
+    def _load_data(self, data=None):
         if data is not None:
             if isinstance(data, (OrderedDict, dict)):
                 for name, value in data.items():
@@ -37,40 +88,96 @@ class Grammar:
                     # {'New York': ['the big apple', 'New York {city?}']}
                     if isinstance(value, list):
                         for x in value:
-                            self.synonyms[name].extend(process_template(x, self.intent.grammars))
+                            self.synonyms[name].extend(process_template(x, self.grammars, self.get_random(x)))
                     else:
                         self.synonyms[name].extend(value.choices)
                         self.choices.extend(value.choices)
 
                     self.used_synonyms.append(name)
             elif isinstance(data, list):
-                [self.load_data(x) for x in data]
+                [self._load_data(x) for x in data]
             elif isinstance(data, str):
                 if '{' in data:
                     dname = data.strip(PATTERN_RESERVED_CHARS)
-                    if dname in self.intent.grammars and self.intent.grammars[dname].choices:
-                        self.load_data({dname: self.intent.grammars[dname]})
+                    if dname in self.grammars and self.grammars[dname].choices:
+                        self._load_data({dname: self.grammars[dname]})
                     else:
-                        values = process_template(data, self.intent.grammars)
+                        values = process_template(data, self.grammars, self.get_random(data))
                         self.synonyms[self.name].extend(values)
                         self.choices.extend(values)
                 else:
-                    self.choices.append(data)
+                    self.choices.append(sys.intern(normalize_whitespace(data)))
+            elif isinstance(data, LazySequence):
+                # i.e. the values of an external file, which are referenced rather than copied if there are many
+                self.choices.extend(data)
             else:
                 raise RuntimeError(f"Unknown type: {data}")
 
+    def index_synonyms(self):
+        """
+        Build the reverse index from every synonym value to its (canonical) synonym name.  When a value belongs to
+        more than one synonym, the first one wins.
+
+        :return: None
+        """
+        self.synonym_index = {}
+        lazy_synonyms = {}
+        for name in self.used_synonyms:
+            for segment in getattr(self.synonyms.get(name), 'segments', ()):
+                if isinstance(segment, list):
+                    for value in segment:
+                        self.synonym_index.setdefault(value, name)
+                else:
+                    # too big to index by value, so it's looked up by position instead
+                    lazy_synonyms.setdefault(id(segment), name)
+
+        self.segment_synonyms = []
+        if lazy_synonyms and isinstance(self.choices, Choices):
+            self.segment_synonyms = [lazy_synonyms.get(id(segment)) for segment in self.choices.segments]
+
+    def get_synonym(self, value: str, index: int = None) -> str:
+        """
+        Get the synonym name that a value belongs to.
+
+        :param value: A value of this grammar
+        :param index: The index of the value in the choices, used for values of lazy synonyms
+        :return: str - The synonym name, or None if the value isn't a synonym
+        """
+        name = self.synonym_index.get(value)
+        if name is None and value and index is not None and self.segment_synonyms:
+            name = self.segment_synonyms[self.choices.locate(index)[0]]
+        return name
+
+    @property
+    def rng(self) -> random.Random:
+        return self.intent.random if self.intent is not None else random
+
+    def get_random(self, template: str) -> random.Random:
+        """
+        Get the random stream used to expand one of this grammar's templates
+
+        :param template: The template text
+        :return: random.Random - The stream
+        """
+        if self.intent is None:
+            # not tied to an intent, so it can be shared by all of them
+            return derive_random(self.seed, self.name, template)
+        return self.intent.get_random(self.name, template)
+
     def update(self, placeholder_text: str, text: str, index: int = None):
         if index is None:
-            self.value = random.choice(self.choices)
+            self.value = self.rng.choice(self.choices)
         else:
             self.value = self.choices[index]
 
         # check to see if we need a synonym
         name = placeholder_text.strip('{}?')
-        if name in self.intent.grammars and self.value in self.intent.grammars[name].synonyms:
+        grammar = self.intent.grammars.get(name, self) if self.intent is not None else self
+        self.entity_value = grammar.get_synonym(self.value)
+        if self.value in grammar.synonyms:
             self.entity_value = self.value
-            if self.intent.grammars[name].synonyms[self.entity_value]:
-                self.value = random.choice(self.intent.grammars[name].synonyms[self.entity_value])
+            if grammar.synonyms[self.entity_value]:
+                self.value = self.rng.choice(grammar.synonyms[self.entity_value])
 
         text = text.replace(placeholder_text, self.value, 1)
 
@@ -89,9 +196,9 @@ class Grammar:
         if not available:
             return None
 
-        self.value = random.choice(list(available))
+        self.value = self.rng.choice(list(available))
         return self.value
 
     def __repr__(self):
-        return f"<{self.__class__.__name__} {self.name} {self.value} n_items={len(self.choices)}"
+        return f"<{self.__class__.__name__} {self.name} {self.value} n_items={size_of(self.choices)}"
 
@@ -0,0 +1,139 @@
+import json
+import logging
+import weakref
+
+from chatter.grammar import Grammar
+from chatter.utils.digest import list_digest, str_digest
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(obj) -> str:
+    # i.e. the values of an external file, which are identified by the file rather than the values
+    signature = getattr(obj, 'signature', None)
+    return signature if signature is not None else str(obj)
+
+
+class GrammarLibrary:
+    """
+    Expanded grammars, shared by every intent in the process.  A grammar is keyed by its name, its yaml data, the
+    seed, and the keys of the grammars it refers to, so intents that include the same grammar files share a single
+    copy of each grammar, while a grammar that refers to a differently defined grammar still gets its own.
+
+    The grammars are held weakly, so a grammar is dropped once no intent uses it anymore.  They are shared, so they
+    must not be modified.
+    """
+
+    def __init__(self):
+        self.grammars = weakref.WeakValueDictionary()
+        self.digests = {}  # id of the owner of yaml data -> (a weak reference to the owner, id of data -> digest)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.grammars)
+
+    def clear(self):
+        self.grammars.clear()
+        self.digests.clear()
+
+    def _forget(self, key, ref):
+        entry = self.digests.get(key)
+        if entry is not None and entry[0] is ref:
+            del self.digests[key]
+
+    def digest(self, data, owner=None) -> str:
+        """
+        Get the digest of a grammar's yaml data.  Included files are parsed once and shared, so the digest of the
+        same data is only worked out once.  The digest is remembered for as long as the data's owner (i.e. the
+        mapping that declares the grammar) is alive; the data isn't kept alive by the library.
+
+        :param data: The yaml data
+        :param owner: The object that holds the data (defaults to the data), it must not be modified
+        :return: str - The digest
+        """
+        owner = data if owner is None else owner
+        entry = self.digests.get(id(owner))
+        if entry is None or entry[0]() is not owner:
+            try:
+                ref = weakref.ref(owner, lambda ref, key=id(owner): self._forget(key, ref))
+            except TypeError:
+                # i.e. a list, which can't be weakly referenced
+                return str_digest(json.dumps(data, default=_json_default))
+            entry = self.digests[id(owner)] = (ref, {})
+
+        digests = entry[1]
+        if id(data) not in digests:
+            digests[id(data)] = str_digest(json.dumps(data, default=_json_default))
+        return digests[id(data)]
+
+    def key(self, name: str, data, is_entity: bool, dependencies: dict, seed=None, owner=None) -> str:
+        """
+        Get the key of a grammar.
+
+        :param name: The name of the grammar
+        :param data: The yaml data of the grammar
+        :param is_entity: Whether the grammar is an entity
+        :param dependencies: The grammars it refers to, by name
+        :param seed: The seed the grammar is expanded with
+        :param owner: The object that holds the yaml data, see `digest`
+        :return: str - The key
+        """
+        references = [f"{reference}={grammar.key}" for reference, grammar in dependencies.items()]
+        return list_digest([name, str(is_entity), repr(seed), self.digest(data, owner)] + references)
+
+    def get(self, name: str, data, is_entity: bool = False, dependencies: dict = None, seed=None,
+            owner=None) -> Grammar:
+        """
+        Get a grammar, loading it if the library doesn't hold it yet.
+
+        :param name: The name of the grammar
+        :param data: The yaml data of the grammar
+        :param is_entity: Whether the grammar is an entity
+        :param dependencies: The grammars it refers to, by name (they must come from this library)
+        :param seed: The seed the grammar is expanded with
+        :param owner: The object that holds the yaml data, see `digest`
+        :return: Grammar - The grammar
+        """
+        dependencies = dependencies or {}
+        key = self.key(name, data, is_entity, dependencies, seed, owner)
+
+        grammar = self.grammars.get(key)
+        if grammar is not None:
+            self.hits += 1
+            return grammar
+
+        self.misses += 1
+        grammar = Grammar(name, is_entity=is_entity, grammars=dependencies, seed=seed)
+        grammar.load_data(data)
+        grammar.key = key
+        self.grammars[key] = grammar
+        return grammar
+
+    def intern(self, grammar: Grammar) -> Grammar:
+        """
+        Get the library's copy of a grammar that was loaded some other way (i.e. unpickled from a snapshot), so
+        intents that are loaded from snapshots share their grammars as well.  A grammar the library doesn't hold yet
+        is added, once the grammars it refers to are interned.
+
+        :param grammar: The grammar
+        :return: Grammar - The shared grammar
+        """
+        if grammar.key is None:
+            return grammar
+
+        shared = self.grammars.get(grammar.key)
+        if shared is not None:
+            if shared is not grammar:
+                self.hits += 1
+            return shared
+
+        # the references are swapped in place, so the expansions that share the dict use the interned grammars too
+        for name, dependency in grammar.grammars.items():
+            grammar.grammars[name] = self.intern(dependency)
+        self.grammars[grammar.key] = grammar
+        return grammar
+
+
+# the library of the current process
+default_library = GrammarLibrary()
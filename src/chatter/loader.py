@@ -1,33 +1,119 @@
 import copy
+import itertools
 import logging
+import multiprocessing
 import os
+import shutil
+import tempfile
 from glob import glob
-from typing import Dict
+from typing import Dict, NamedTuple
 
+from chatter import __version__
+from chatter.corpus import CorpusWriter
+from chatter.dedup import make_filter
 from chatter.exceptions import PlaceholderError, GrammarError
+from chatter.manifest import OUTPUT_VERSION, Manifest
 from chatter.rasa_nlu import RasaNLUIntent
-from chatter.utils.yaml import load_yaml
+from chatter.snapshot import SnapshotCache, snapshot_key
+from chatter.utils.digest import list_digest
+from chatter.utils.shard import shard_range
+from chatter.utils.yaml import IncludeCache, load_yaml
+from chatter.writer import RasaNLUWriter, BUFFER_SIZE
 
 logger = logging.getLogger(__name__)
 
+_worker_loader = None
+
+
+def _init_worker(settings):
+    global _worker_loader
+    _worker_loader = RasaNLULoader(**settings)
+
+
+def _run_task(args):
+    method, task = args
+    return getattr(_worker_loader, method)(*task)
+
+
+class IntentTask(NamedTuple):
+    """
+    An intent that is waiting to be built.
+    """
+    filename: str
+    name: str
+    data: dict
+    digest: str = None  # the digest of the intent's file and every file it includes
+
 
 class RasaNLULoader:
 
-    def __init__(self, num=1, test_ratio=0):
+    def __init__(self, num=1, test_ratio=0, streaming=False, jobs=1, seed=None, shard=None, cache_dir=None,
+                 coverage=None, dedup=None, dedup_scope='global', exhaustive=False):
         self.num = num
         self.replace_existing = True
         self.clean_directory = True
         self.test_ratio = test_ratio
+        self.streaming = streaming
+        self.jobs = jobs
+        self.seed = seed
+        self.shard = shard
+        self.cache_dir = cache_dir
+        self.coverage = coverage
+        self.exhaustive = exhaustive  # generate every combination of every template, in order (`num` is ignored)
+        if coverage and exhaustive:
+            raise ValueError("A covering array and every combination can't be generated at the same time")
+        self.dedup = dedup  # the duplicate filter to drop repeated texts with, see `chatter.dedup.parse_dedup`
+        self.dedup_scope = dedup_scope
+        self.duplicates = 0
+        self.text_filter = None
+        if dedup is not None and dedup_scope == 'global':
+            if self.processes > 1:
+                raise ValueError("Duplicates can only be dropped across intents in a single process, "
+                                 "drop them per intent or use one job")
+            self.text_filter = make_filter(dedup)
+        self.snapshots = SnapshotCache(cache_dir) if cache_dir is not None else None
+        self.include_cache = IncludeCache()
+        # the grammars of the intents built so far, by key.  The library only holds grammars weakly, and when
+        # streaming, every intent is dropped before the next one is built, so they are kept alive for the whole run
+        self.pinned_grammars = {}
         self.intents = []
+        self.tasks = []
+
+    @property
+    def processes(self) -> int:
+        """
+        The number of processes to generate with (a `jobs` of 0 or less means one per CPU)
+        """
+        return self.jobs if self.jobs > 0 else os.cpu_count()
+
+    def _ensure_outdir(self, dirname, keep=()):
+        """
+        Create an output directory, and remove the stale outputs from it.
 
-    def _ensure_outdir(self, dirname):
+        :param dirname: The directory
+        :param keep: The outputs that are still current, or are about to be replaced
+        :return: None
+        """
         dirname = os.path.abspath(dirname)
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
         if self.clean_directory:
+            keep = set(os.path.abspath(filename) for filename in keep)
             for filename in glob(os.path.join(dirname, "*.json")):
-                os.remove(filename)
+                if filename not in keep:
+                    os.remove(filename)
+
+    def _get_filename(self, outdir, name, used=None, check_exists=True):
+        filename = os.path.join(outdir, name + ".json")
+
+        orig_filename = copy.copy(filename)
+        index = 1
+        while (check_exists and os.path.exists(filename)) or (used is not None and filename in used):
+            basename, ext = os.path.splitext(orig_filename)
+            filename = "".join([basename, str(index), ext])
+            index += 1
+        return filename
 
     def save(self, outdir, testing=False):
         self._ensure_outdir(outdir)
@@ -40,17 +126,257 @@ class RasaNLULoader:
             if self.replace_existing is False and os.path.exists(filename):
                 logger.info(f"Skipping {filename}...")
             else:
-                orig_filename = copy.copy(filename)
-                index = 1
-                while os.path.exists(filename):
-                    basename, ext = os.path.splitext(orig_filename)
-                    filename = "".join([basename, str(index), ext])
-                    index += 1
-
+                filename = self._get_filename(outdir, intent.name)
                 logger.info(f"Generating: {filename}")
                 with open(filename, 'w') as fp:
                     fp.write(data)
 
+    def _plan(self, outdirs):
+        """
+        Assign the output filenames of every pending intent up front, in load order, so they are the same no matter
+        which order the intents finish in.
+
+        When the output directories are cleaned, the existing files are replaced rather than avoided.
+
+        :param outdirs: The directories each intent is written to
+        :return: list - The export tasks
+        """
+        used = set()
+        tasks = []
+        for task in self.tasks:
+            outfiles = []
+            for dirname in outdirs:
+                outfile = os.path.join(dirname, task.name + ".json")
+                if self.replace_existing is False and os.path.exists(outfile):
+                    logger.info(f"Skipping {outfile}...")
+                    outfiles.append(None)
+                    continue
+
+                outfile = self._get_filename(dirname, task.name, used, check_exists=not self.clean_directory)
+                used.add(outfile)
+                outfiles.append(outfile)
+            tasks.append((task, outfiles))
+        return tasks
+
+    def _map(self, method, tasks, ordered=False):
+        """
+        Run a loader method over the tasks, either in this process, or in a pool of `jobs` processes.
+
+        :param method: The name of the method to call with each task
+        :param tasks: A list of argument tuples
+        :param ordered: If True, the results are yielded in task order, otherwise as soon as they are ready
+        :return: generator - The results of each call
+        """
+        jobs = self.processes
+        if jobs <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield getattr(self, method)(*task)
+            return
+
+        settings = dict(num=self.num, test_ratio=self.test_ratio, streaming=True, seed=self.seed, shard=self.shard,
+                        cache_dir=self.cache_dir, coverage=self.coverage, dedup=self.dedup,
+                        dedup_scope=self.dedup_scope, exhaustive=self.exhaustive)
+        with multiprocessing.Pool(min(jobs, len(tasks)), _init_worker, (settings,)) as pool:
+            imap = pool.imap if ordered else pool.imap_unordered
+            for result in imap(_run_task, [(method, task) for task in tasks]):
+                yield result
+
+    def export(self, outdir, testdir=None):
+        """
+        Generate the examples of every loaded intent, and stream them straight into the output files.  Unlike
+        `save`, the examples are never held in memory, so the intents should be loaded with `streaming` enabled.
+
+        Each output directory has a manifest of the inputs its files were generated from.  Files whose inputs haven't
+        changed since they were generated are kept as they are.
+
+        :param outdir: The directory to write the training data to
+        :param testdir: The directory to write the testing data to (testing examples are dropped if None)
+        :return: None
+        """
+        outdirs = [outdir] if testdir is None else [outdir, testdir]
+        manifests = [Manifest(dirname) for dirname in outdirs]
+        kinds = ['training', 'testing'][:len(outdirs)]
+
+        tasks = []
+        generated = []  # the outputs to generate, and the digests of their inputs
+        keep = set()
+        for task, outfiles in self._plan(outdirs):
+            digests = [self._output_digest(task, kind) for kind in kinds]
+            outputs = [(manifest, outfile, digest)
+                       for manifest, outfile, digest in zip(manifests, outfiles, digests) if outfile is not None]
+            keep.update(os.path.join(dirname, task.name + ".json") if outfile is None else outfile
+                        for dirname, outfile in zip(outdirs, outfiles))
+
+            if digests[0] is not None and all(manifest.is_current(outfile, digest)
+                                              for manifest, outfile, digest in outputs):
+                logger.info(f"Skipping {task.name}, its inputs haven't changed")
+                continue
+
+            tasks.append((task, outfiles))
+            generated.extend(outputs)
+
+        for dirname, manifest in zip(outdirs, manifests):
+            self._ensure_outdir(dirname, keep)
+            for filename in list(manifest.entries):
+                if os.path.join(dirname, filename) not in keep:
+                    manifest.discard(filename)
+        # the outputs are forgotten until they are generated, in case generating them fails
+        for manifest, outfile, digest in generated:
+            manifest.discard(outfile)
+        for manifest in manifests:
+            manifest.save()
+
+        for result in self._map('export_intent', tasks):
+            if result is not None:
+                name, duplicates = result
+                self.duplicates += duplicates
+                logger.info(f"Finished {name}")
+
+        for manifest, outfile, digest in generated:
+            if digest is not None:
+                manifest.set(outfile, digest)
+        for manifest in manifests:
+            manifest.save()
+
+    def _output_digest(self, task, kind):
+        """
+        Get the digest of everything an output file is generated from.
+
+        :param task: The intent the file is generated from
+        :param kind: Either 'training' or 'testing'
+        :return: str - The digest, or None if the output can't be reused (unseeded runs are different every time, and
+         when duplicates are dropped across intents, an intent's output depends on every intent before it)
+        """
+        if self.seed is None or task.digest is None or self.text_filter is not None:
+            return None
+        return list_digest([__version__, str(OUTPUT_VERSION), task.digest, task.name, kind, str(self.num), str(self.test_ratio),
+                            repr(self.seed), repr(self.shard), repr(self.coverage), repr(self.dedup),
+                            str(self.exhaustive)])
+
+    def export_intent(self, task, outfiles):
+        intent = self.load_intent(task)
+        if intent is None:
+            return None
+
+        writers = []
+        for outfile in outfiles:
+            if outfile is not None:
+                logger.info(f"Generating: {outfile}")
+                writers.append(RasaNLUWriter(outfile).open())
+            else:
+                writers.append(None)
+
+        training, testing = (writers + [None])[:2]
+        intent.write(training, testing, self.num, self.test_ratio, self.shard)
+        self._log_duplicates(intent)
+        return intent.name, intent.duplicates
+
+    def export_sentences(self, outfile, spool_dir=None):
+        """
+        Generate the examples of every loaded intent, and write their text to `outfile`, one sentence per line.  The
+        sentences are written as they are rendered, so memory use doesn't grow with the number of sentences.
+
+        When sharding, the shards are slices of all the sentences (across intents), so concatenating the output of
+        every shard gives exactly the output of a run without shards.
+
+        :param outfile: The file to write the sentences to, either a filename or an open (text) file
+        :param spool_dir: Where the workers spool their sentences (defaults to the directory of `outfile`)
+        :return: None
+        """
+        if isinstance(outfile, str):
+            if spool_dir is None:
+                spool_dir = os.path.dirname(os.path.abspath(outfile))
+            with open(outfile, 'w', buffering=BUFFER_SIZE) as fp:
+                return self.export_sentences(fp, spool_dir)
+
+        fp = outfile
+        if self.processes <= 1 or len(self.tasks) <= 1:
+            intents = self.iter_intents()
+            ranges = itertools.repeat((0, None))
+            if self.shard is not None:
+                intents = list(intents)
+                ranges = self._sentence_ranges([intent.get_counts(self.num)[0] for intent in intents])
+
+            for intent, (start, stop) in zip(intents, ranges):
+                if start != stop:
+                    self.duplicates += self._write_sentences(intent, fp, start, stop)
+            return
+
+        ranges = itertools.repeat((0, None))
+        if self.shard is not None:
+            counts = self._map('count_intent', [(task,) for task in self.tasks], ordered=True)
+            ranges = self._sentence_ranges(list(counts))
+
+        # each worker spools its intent to a temporary file, which are appended in load order
+        if spool_dir is None:
+            spool_dir = tempfile.gettempdir()
+        tasks = [(task, spool_dir, start, stop) for task, (start, stop) in zip(self.tasks, ranges) if start != stop]
+        for result in self._map('spool_sentences', tasks, ordered=True):
+            if result is None:
+                continue
+            spool_file, duplicates = result
+            self.duplicates += duplicates
+            with open(spool_file, 'r') as spool:
+                shutil.copyfileobj(spool, fp, BUFFER_SIZE)
+            os.remove(spool_file)
+
+    def export_corpus(self, outfile):
+        """
+        Generate the examples of every loaded intent, and write them to `outfile` as a compact corpus of combination
+        records (see `chatter.corpus.CorpusWriter`), rather than as text.
+
+        :param outfile: The file to write the corpus to
+        :return: int - The number of examples written
+        """
+        intents = list(self.iter_intents())
+        with CorpusWriter(outfile, intents) as writer:
+            for intent in intents:
+                num = intent.get_counts(self.num)[0]
+                for text, combination in intent.get_combinations(num):
+                    writer.write(intent.parser_map[text], combination)
+            count = writer.count
+        return count
+
+    def _sentence_ranges(self, counts):
+        """
+        Map this loader's shard of all the sentences onto the intents.
+
+        :param counts: The number of sentences of each intent
+        :return: list - The start and stop of each intent's part of the shard
+        """
+        start, stop = shard_range(sum(counts), self.shard)
+        ranges = []
+        offset = 0
+        for count in counts:
+            ranges.append((min(max(start - offset, 0), count), min(max(stop - offset, 0), count)))
+            offset += count
+        return ranges
+
+    def _write_sentences(self, intent, fp, start=0, stop=None):
+        fp.writelines(text + "\n" for text in intent.sentences(self.num, start=start, stop=stop))
+        self._log_duplicates(intent)
+        return intent.duplicates
+
+    def _log_duplicates(self, intent):
+        if intent.duplicates:
+            logger.info(f"Dropped {intent.duplicates} duplicate examples of {intent.name}")
+
+    def count_intent(self, task):
+        intent = self.load_intent(task)
+        if intent is None:
+            return 0
+        return intent.get_counts(self.num)[0]
+
+    def spool_sentences(self, task, spool_dir, start=0, stop=None):
+        intent = self.load_intent(task)
+        if intent is None:
+            return None
+
+        fd, spool_file = tempfile.mkstemp(prefix=f".{task.name}.", suffix=".txt", dir=spool_dir)
+        with open(fd, 'w', buffering=BUFFER_SIZE) as fp:
+            duplicates = self._write_sentences(intent, fp, start, stop)
+        return spool_file, duplicates
+
     def save_tests(self, outdir):
         self.save(outdir, testing=True)
 
@@ -64,29 +390,135 @@ class RasaNLULoader:
         return self.intents
 
     def load_file(self, filename):
-        data_set = load_yaml(filename)
-
         # usually only one intent per file, but can do multiple
-        for data in data_set:
-            for intent_name, intent_data in data.items():
-                try:
-                    intent = RasaNLUIntent(intent_name).load(intent_data)
-                    intent.process(self.num, self.test_ratio)
-                    self.intents.append(intent)
-                except PlaceholderError as err:
-                    err.filename = filename
-                    logger.error(f"{err}. Ensure that the grammar is defined or included.")
-                except GrammarError as err:
-                    raise GrammarError(f"Error in file {filename}: {err}")
+        tasks = self._get_snapshot_tasks(filename)
+        if tasks is None:
+            tasks = self._parse_file(filename)
+
+        for task in tasks:
+            if self.streaming:
+                # generated later on, by `export` or `export_sentences`
+                self.tasks.append(task)
+                continue
+
+            intent = self.load_intent(task)
+            if intent is not None:
+                intent.process(self.num, self.test_ratio)
+                self._log_duplicates(intent)
+                self.duplicates += intent.duplicates
+                self.intents.append(intent)
+
+    def _parse_file(self, filename) -> list:
+        """
+        Parse an intent file, and record the files it includes (see `SnapshotCache.save_source`).
+
+        :param filename: The intent file
+        :return: list - An `IntentTask` for each of its intents
+        """
+        includes = []
+        data_set = load_yaml(filename, self.include_cache, includes)
+
+        digest = list_digest([self.include_cache.digest(name) for name in [filename] + includes])
+        tasks = [IntentTask(filename, intent_name, intent_data, digest)
+                 for data in data_set for intent_name, intent_data in data.items()]
+        if self.snapshots is not None:
+            self.snapshots.save_source(filename, includes, digest, [task.name for task in tasks])
+        return tasks
+
+    def _get_snapshot_tasks(self, filename):
+        """
+        Get the intents of a file from their snapshots, without parsing the file.  Only the digests of the file and
+        the files it included the last time it was parsed are worked out, so this only works if none of them has
+        changed, and every intent has a snapshot.
+
+        :param filename: The intent file
+        :return: list - An `IntentTask` for each of its intents (with no data), or None if the file must be parsed
+        """
+        if self.snapshots is None:
+            return None
+        record = self.snapshots.load_source(filename)
+        if record is None:
+            return None
+
+        try:
+            digest = list_digest([self.include_cache.digest(name) for name in [filename] + record['includes']])
+        except OSError:
+            return None
+        if digest != record['digest']:
+            return None
+        if not all(self.snapshots.exists(snapshot_key(digest, name, self.seed)) for name in record['names']):
+            return None
+        return [IntentTask(filename, name, None, digest) for name in record['names']]
+
+    def load_intent(self, task: IntentTask):
+        """
+        Build a single intent from its yaml data, or load it from its snapshot if the sources haven't changed since it
+        was last built.
+
+        :param task: The intent to build
+        :return: RasaNLUIntent - The intent, or None if it couldn't be loaded
+        """
+        key = None
+        if self.snapshots is not None and task.digest is not None:
+            key = snapshot_key(task.digest, task.name, self.seed)
+            intent = self.snapshots.load(key)
+            if intent is not None:
+                intent.share_grammars()
+                if self.seed is None:
+                    intent.reset_random()
+                return self._prepare(intent)
+
+        data = task.data
+        if data is None:
+            # the snapshot was expected, but it's gone (or broken), so the file has to be parsed after all
+            data = next(parsed.data for parsed in self._parse_file(task.filename) if parsed.name == task.name)
+        try:
+            intent = RasaNLUIntent(task.name, self.seed).load(data)
+        except PlaceholderError as err:
+            err.filename = task.filename
+            logger.error(f"{err}. Ensure that the grammar is defined or included.")
+            return None
+        except GrammarError as err:
+            raise GrammarError(f"Error in file {task.filename}: {err}")
+
+        if key is not None:
+            self.snapshots.save(key, intent)
+        return self._prepare(intent)
+
+    def _prepare(self, intent):
+        for grammar in intent.grammars.values():
+            if grammar.key is not None:
+                self.pinned_grammars.setdefault(grammar.key, grammar)
+        if self.exhaustive:
+            intent.exhaustive = True
+        if self.coverage:
+            intent.set_coverage(self.coverage)
+        if self.dedup is not None:
+            intent.dedup = self.text_filter if self.text_filter is not None else make_filter(self.dedup)
+        return intent
+
+    def iter_intents(self):
+        """
+        Build the intents that are waiting to be generated, one at a time.
+
+        :return: generator - The loaded intents
+        """
+        for task in self.tasks:
+            intent = self.load_intent(task)
+            if intent is not None:
+                yield intent
 
     def load_from_dir(self, dirname):
         # traverse root directory, and list directories as dirs and files as files
         for root, dirs, files in os.walk(dirname):
+            # walk in a stable order, so every run (and every shard) sees the intents in the same order
+            dirs.sort()
+
             # TODO: For now skip these specific directories,
             # but this should be gleaned from the includes in the yml files
             if os.path.basename(root) in ['grammars', 'entities']:
                 continue
 
-            for file in files:
+            for file in sorted(files):
                 if file.endswith('.yml') or file.endswith('.yaml'):
                     self.load_file(os.path.join(root, file))
@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import tempfile
+
+from chatter.utils.files import replace_file
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = '.chatter-manifest.json'
+# bump this whenever the output of a seeded run changes (i.e. the way combinations are drawn or rendered), so the
+# outputs that were generated before aren't reused
+OUTPUT_VERSION = 3
+
+
+class Manifest:
+    """
+    The digests of the inputs that every file in an output directory was generated from, so a file whose inputs
+    haven't changed doesn't have to be generated (and rewritten) again.
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.filename = os.path.join(dirname, MANIFEST_FILENAME)
+        self.entries = {}  # output basename -> the digest of its inputs
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as fp:
+                entries = json.load(fp)
+        except FileNotFoundError:
+            entries = {}
+        except ValueError as err:
+            logger.warning(f"Ignoring the broken manifest {self.filename}: {err}")
+            entries = {}
+        self.entries = entries if isinstance(entries, dict) else {}
+
+    def save(self):
+        # written to a temporary file first, so the manifest is never half written
+        fd, tmp_filename = tempfile.mkstemp(prefix=f"{MANIFEST_FILENAME}.", dir=self.dirname)
+        try:
+            with open(fd, 'w') as fp:
+                json.dump(self.entries, fp, indent=2, sort_keys=True)
+            replace_file(tmp_filename, self.filename)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
+
+    def is_current(self, outfile, digest) -> bool:
+        """
+        Check if an output file was generated from the same inputs.
+
+        :param outfile: The output file
+        :param digest: The digest of its inputs
+        :return: bool - True if the file exists and doesn't have to be generated again
+        """
+        return self.entries.get(os.path.basename(outfile)) == digest and os.path.exists(outfile)
+
+    def set(self, outfile, digest):
+        self.entries[os.path.basename(outfile)] = digest
+
+    def discard(self, outfile):
+        self.entries.pop(os.path.basename(outfile), None)
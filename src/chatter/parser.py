@@ -1,7 +1,9 @@
 import copy
 import logging
 import random
+from typing import NamedTuple
 
+from chatter.choices import size_of
 from chatter.combinator import Combinator
 from chatter.exceptions import PlaceholderError
 from chatter.utils.regex import REPLACEMENT_PATTERN
@@ -13,12 +15,77 @@ PATTERN_PRIORITY = ">"
 logger = logging.getLogger(__name__)
 
 
+def normalize_whitespace(text: str) -> str:
+    """
+    Collapse every run of whitespace into a single space, and strip the ends
+    """
+    return " ".join(text.split())
+
+
+def compile_literal(text: str) -> tuple:
+    """
+    Split a literal part of a template into its normalized text, and whether it starts or ends with whitespace.
+
+    :param text: The literal text between (or around) placeholders
+    :return: tuple - The normalized text, and the leading and trailing whitespace flags
+    """
+    return normalize_whitespace(text), text[:1].isspace(), text[-1:].isspace()
+
+
+def place(parts: list, length: int, space: bool, core: str, leading: bool, trailing: bool) -> tuple:
+    """
+    Add a segment's text to a text that is being rendered, collapsing whitespace as it goes (just like
+    ``" ".join(text.split())`` would), so the start and end of each segment are known as soon as it's placed.
+
+    :param parts: The parts of the text so far, the segment's text is appended to them
+    :param length: The length of the text so far
+    :param space: Whether a space is owed before the next text
+    :param core: The (normalized) text of the segment
+    :param leading: Whether the segment starts with whitespace
+    :param trailing: Whether the segment ends with whitespace
+    :return: tuple - The new length and owed space, and where the segment's text starts
+    """
+    if leading:
+        space = True
+    start = length
+    if core:
+        if space and parts:
+            parts.append(" ")
+            length += 1
+        start = length
+        parts.append(core)
+        length += len(core)
+        space = trailing
+    return length, space, start
+
+
+class Span(NamedTuple):
+    """
+    Where a placeholder's value ended up in a rendered text.
+    """
+    name: str
+    value: str
+    synonym: str  # the synonym the value belongs to, or None
+    start: int
+    end: int
+
+
+class Rendering(NamedTuple):
+    """
+    A rendered combination.
+    """
+    text: str
+    spans: tuple  # a `Span` for each placeholder of the template, in order
+
+
 class TextParser:
-    def __init__(self, text, grammars=None):
+    def __init__(self, text, grammars=None, rng: random.Random = None):
         self.grammars = grammars
+        self.random = rng
         self.placeholders = []
         self.names = []
         self.text = copy.copy(text)
+        self.segments = []  # (literal text, leading space, trailing space, placeholder index or -1)
         self.combinator = None
 
         self.setup_placeholders()
@@ -53,47 +120,140 @@ class TextParser:
         """
         from chatter.placeholder import PlaceHolder
 
-        for pattern in REPLACEMENT_PATTERN.findall(self.text):
+        pieces = REPLACEMENT_PATTERN.split(self.text)
+        for index, pattern in enumerate(pieces[1::2]):
             p = PlaceHolder(pattern)
 
             if self.grammars is not None:
                 try:
-                    p.index_range = len(self.grammars[p.name].choices)
+                    p.index_range = size_of(self.grammars[p.name].choices)
                 except:
                     raise PlaceholderError(grammar_name=p.name, placeholder_text=self.text)
             self.names.append(p.name)
             self.placeholders.append(p)
 
-        self.combinator = Combinator(self.placeholders)
+            self.segments.append(compile_literal(pieces[index * 2]) + (-1,))
+            self.segments.append(('', False, False, index))
+        self.segments.append(compile_literal(pieces[-1]) + (-1,))
 
-    def process(self, combination: list, grammars: dict):
+        self.combinator = Combinator(self.placeholders, self.random)
+
+    def process(self, combination: list, grammars: dict = None) -> str:
         """
         Given a dictionary of grammars, use the combination, and transform the text template and return it.
 
-        :param combination: A list of indexes into the grammar dictionary
+        :param combination: A list of indexes into the grammar dictionary (the last index of an optional placeholder
+         leaves it out)
         :param grammars: A dictionary of grammars with the key being the name of the grammar, and the value is the
-         possible choices of that grammar.
+         possible choices of that grammar (defaults to the parser's grammars).
         :return: str - A new string with all placeholders replaced with grammars
         """
-        text = copy.copy(self.text)
-        for index, name in enumerate(self.names):
-            choice_index = combination[index]
-            p = self.placeholders[index]
-            value = grammars[name].choices[choice_index]
-
-            if p.optional:
-                # flip a coin
-                value = random.choice([value, ''])
-
-            for syn in grammars[name].used_synonyms:
-                if value in grammars[name].synonyms[syn]:
-                    p.synonym = syn
-                    break
-            p.value = value
-            p.start = text.find(p.pattern)
-            p.end = p.start + len(value)
-            text = text.replace(p.pattern, value, 1)
-
-            # clear up any whitespace issues...
-            text = " ".join(text.split())
-        return text
+        return self._render(combination, grammars, None)
+
+    def render(self, combination: list, grammars: dict = None) -> Rendering:
+        """
+        Render a combination into its text, and the span of every placeholder in it.  Nothing is changed (on the
+        parser or its placeholders), so a parser can render from many threads at once.
+
+        :param combination: A list of indexes into the grammar dictionary
+        :param grammars: The grammars (defaults to the parser's grammars)
+        :return: Rendering - The text, and a `Span` for each placeholder
+        """
+        spans = []
+        text = self._render(combination, grammars, spans)
+        return Rendering(text, tuple(spans))
+
+    def _render(self, combination: list, grammars: dict, spans: list) -> str:
+        # the text is rendered in a single pass over the compiled segments, see `place`
+        if grammars is None:
+            grammars = self.grammars
+
+        parts = []
+        length = 0
+        space = False
+        for core, leading, trailing, index in self.segments:
+            if index >= 0:
+                p = self.placeholders[index]
+                grammar = grammars[p.name]
+                choice_index = combination[index]
+                if p.optional and choice_index == p.index_range:
+                    # the combination leaves this placeholder out
+                    core = ''
+                else:
+                    core = grammar.choices[choice_index]
+
+            length, space, start = place(parts, length, space, core, leading, trailing)
+
+            if index >= 0 and spans is not None:
+                spans.append(Span(p.name, core, grammar.get_synonym(core, choice_index), start, length))
+        return "".join(parts)
+
+    def render_all(self, grammars: dict = None, start: int = 0, stop: int = None, spans: bool = True):
+        """
+        Render the combinations in odometer order: the order of `itertools.product`, where the last placeholder
+        changes fastest (i.e. the combination at position `i` is ``decode_mixed_radix(i, radices)``).
+
+        Consecutive combinations only differ from the placeholder that changed onwards, so the text and spans before
+        it are kept, and only the rest of the template is rendered again.  Each rendering is the same as `render`
+        gives for its combination.
+
+        :param grammars: The grammars (defaults to the parser's grammars)
+        :param start: The position of the first combination
+        :param stop: The position to stop at (defaults to every combination)
+        :param spans: Whether to work out the spans (they are left empty if False)
+        :return: generator - A `Rendering` of each combination
+        """
+        from chatter.utils.permutation import decode_mixed_radix
+
+        if grammars is None:
+            grammars = self.grammars
+        radices = self.combinator.radices
+        stop = self.combinator.count if stop is None else min(stop, self.combinator.count)
+        if start >= stop:
+            return
+
+        segments = self.segments
+        placeholders = self.placeholders
+        n_placeholders = len(placeholders)
+        combination = decode_mixed_radix(start, radices)
+
+        parts = []
+        found = []
+        core, leading, trailing, _ = segments[0]
+        length, space, _ = place(parts, 0, False, core, leading, trailing)
+        # the state of the text before each placeholder: the number of parts, the length, the owed space and the
+        # number of spans
+        checkpoints = [(len(parts), length, space, 0)] * n_placeholders
+        changed = 0
+        for _ in range(start, stop):
+            if n_placeholders:
+                count, length, space, n_spans = checkpoints[changed]
+                del parts[count:]
+                del found[n_spans:]
+                for index in range(changed, n_placeholders):
+                    checkpoints[index] = (len(parts), length, space, len(found))
+                    p = placeholders[index]
+                    grammar = grammars[p.name]
+                    choice_index = combination[index]
+                    if p.optional and choice_index == p.index_range:
+                        core = ''
+                    else:
+                        core = grammar.choices[choice_index]
+
+                    length, space, begin = place(parts, length, space, core, False, False)
+                    if spans:
+                        found.append(Span(p.name, core, grammar.get_synonym(core, choice_index), begin, length))
+
+                    core, leading, trailing, _ = segments[2 * index + 2]
+                    length, space, _ = place(parts, length, space, core, leading, trailing)
+
+            yield Rendering("".join(parts), tuple(found))
+
+            # turn the odometer: the last placeholders that are at their last index wrap around to 0
+            changed = n_placeholders - 1
+            while changed >= 0 and combination[changed] + 1 == radices[changed]:
+                combination[changed] = 0
+                changed -= 1
+            if changed < 0:
+                return
+            combination[changed] += 1
@@ -26,8 +26,8 @@ class PlaceHolder:
         return f"<PlaceHolder {self.name}: {self.value} [{self.start}, {self.end}]>"
 
 
-def get_all_possible_values(text, grammars):
-    parser = TextParser(text, grammars)
+def get_all_possible_values(text, grammars, rng=None):
+    parser = TextParser(text, grammars, rng)
     rv = []
     for _ in range(parser.combinator.count):
         combination = parser.combinator.get()
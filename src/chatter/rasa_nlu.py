@@ -1,29 +1,55 @@
 import copy
+import itertools
 import json
 import logging
 import math
-import queue
 import random
 from collections import defaultdict, OrderedDict
 from typing import List
 
 from chatter.common_example import CommonExample
 from chatter.exceptions import PlaceholderError, GrammarError
-from chatter.grammar import Grammar
+from chatter.grammar import get_references
+from chatter.library import default_library
 from chatter.parser import TextParser, PATTERN_RESERVED_CHARS
+from chatter.scheduler import TemplateScheduler, allocate
+from chatter.utils import batch
+from chatter.utils.graph import topological_order
+from chatter.utils.seed import derive_random
+from chatter.utils.shard import shard_range
+from chatter.writer import RasaNLUWriter
 
 logger = logging.getLogger(__name__)
 
 
+def iter_definitions(data):
+    """
+    Walk the yaml data of a grammars (or entities) section.
+
+    :param data: A dict of grammar name -> its data, or a list of them
+    :return: generator - The name and data of every grammar, and the dict it's declared in, in the order they are
+     declared
+    """
+    if isinstance(data, list):
+        for obj in data:
+            yield from iter_definitions(obj)
+    else:
+        for name, value in data.items():
+            yield name.strip(PATTERN_RESERVED_CHARS), value, data
+
+
 class Texts:
     def __init__(self):
         self.available = []
-        self.used = []
-        self.important_count = 0
+        self.important = []  # the texts that must be in at least one example
 
     @property
     def count(self) -> int:
-        return sum(self.available + self.used)
+        return len(self.available)
+
+    @property
+    def important_count(self) -> int:
+        return len(self.important)
 
     def load(self, texts):
         # self.domain = intent_data['domain']
@@ -38,39 +64,29 @@ class Texts:
                 for name, value in text.items():
                     if name == 'important':
                         self.available[0:0] += value
-                        self.important_count += 1
+                        self.important.extend(value)
             else:
                 raise RuntimeError(f"Unknown type in 'texts' section: {text}")
 
-    def invalidate_text(self, text):
-        if text in self.available:
-            self.available.remove(text)
-            self.used.append(text)
-
-    def get(self):
-        """
-        Pick an unused text by poping it off the top of the stack
-
-        :return: str - The next unused text
-        """
-        while self.available:
-            text = self.available.pop()
-            self.used.append(text)
-            yield text
-
-    def get_used(self):
-        """
-        Randomly pick from the "used" list.
-
-        :return: str - A random text
-        """
-        if self.used:
-            return random.choice(self.used)
-
 
 class Intent:
-    def __init__(self, intent_name=None):
+    # the number of combinations drawn at once when NumPy is available (0 draws them one at a time)
+    batch_size = batch.BATCH_SIZE
+    # the strength of the covering array every template is generated from (0 picks random combinations instead)
+    coverage = 0
+    # generates every combination of every template once, in order, instead of drawing them
+    exhaustive = False
+    # the grammars shared with the other intents
+    library = default_library
+    # drops the examples whose text was generated before (see `chatter.dedup`), it can be shared with other intents
+    dedup = None
+    # the number of examples dropped as duplicates
+    duplicates = 0
+
+    def __init__(self, intent_name=None, seed=None):
         self.name = intent_name
+        self.seed = seed
+        self.random = derive_random(seed, intent_name)
         self.domain = None
         self.texts: Texts = None
         self.text_parsers: List[TextParser] = []
@@ -78,103 +94,260 @@ class Intent:
         self.grammars = {}
         self.entities = {}
         self.synonyms = defaultdict(list)
-        self.grammar_queue = queue.Queue()
 
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.name} n_texts={self.texts.count}>"
 
+    def reset_random(self):
+        """
+        Derive the random streams from the seed again, and start the combinations over (i.e. so an unseeded intent
+        that was loaded from a snapshot doesn't repeat the examples of the run that saved it).
+
+        :return: None
+        """
+        self.random = derive_random(self.seed, self.name)
+        for parser in self.text_parsers:
+            parser.random = self.get_random(parser.text)
+            parser.combinator.random = parser.random
+            parser.combinator.reset_combinations()
+
+    def get_random(self, *names) -> random.Random:
+        """
+        Get a random stream for part of this intent (i.e. a single template), derived from the intent's seed.
+
+        :param names: The names that identify the part
+        :return: random.Random - The stream
+        """
+        return derive_random(self.seed, self.name, *names)
+
     def get_possible_combinations(self):
         return {parser.text: parser.possible_combinations for parser in self.text_parsers}
 
     def get_possible_combination_count(self):
         return sum(self.get_possible_combinations().values()) or 1
 
-    def get_parser_combination(self, parser: TextParser):
-        rv = parser.combinator.get()
-        if rv is None:
-            self.texts.invalidate_text(parser.text)
-            return parser.combinator.get_used()
-        return rv
+    def set_coverage(self, strength: int):
+        """
+        Generate the examples from a covering array of each template, rather than from random picks: every
+        combination of values of any `strength` placeholders of a template is used at least once, in (close to) as
+        few examples as possible.  The number of examples is then decided by the covering arrays.
 
-    def get_combinations(self, num):
+        :param strength: The number of placeholders whose values are covered together (2 for pairwise)
+        :return: None
+        """
+        self.coverage = strength
+        for parser in self.parser_map.values():
+            parser.combinator.ensure_coverage(strength)
+
+    def get_coverage_count(self) -> int:
+        return sum(len(parser.combinator.front) for parser in self.parser_map.values())
+
+    def get_combinations(self, num, start=0, stop=None):
+        """
+        Get the combination of each example.  The examples of the random picks can be addressed directly (see
+        `TemplateScheduler.locate` and `Combinator.handed`), so a slice only draws its own combinations, and they are
+        exactly the ones that a run without a slice would have at the same positions.
+
+        :param num: The number of examples
+        :param start: The position of the first example
+        :param stop: The position to stop at (defaults to `num`)
+        :return: generator - The text of the template and the combination of each example
+        """
+        stop = num if stop is None else min(stop, num)
+        if self.exhaustive or self.coverage:
+            yield from itertools.islice(self._get_ordered_combinations(), start, stop)
+            return
+
+        if self.batch_size and batch.has_numpy():
+            texts = list(self.parser_map)
+            for picks, matrices in self.get_combination_batches(num, self.batch_size, start, stop):
+                rows = [iter(matrix.tolist()) for matrix in matrices]
+                for index in picks.tolist():
+                    yield texts[index], next(rows[index])
+            return
+
+        parsers, scheduler = self.get_scheduler(num)
+        for position in range(start, stop):
+            template, rank = scheduler.locate(position)
+            parser = parsers[template]
+            yield parser.text, parser.combinator.handed(rank)
+
+    def _get_ordered_combinations(self):
+        if self.exhaustive:
+            # each template in turn, with its combinations in order (see `TextParser.render_all`)
+            for text, parser in self.parser_map.items():
+                for combination in itertools.product(*[range(radix) for radix in parser.combinator.radices]):
+                    yield text, list(combination)
+        else:
+            # each template in turn, with the rows of its covering array
+            for text, parser in self.parser_map.items():
+                for combination in parser.combinator.front:
+                    yield text, list(combination)
+
+    def get_quotas(self, num) -> list:
+        """
+        Decide how many of `num` examples are rendered from each template (in the order of `parser_map`).  Every
+        important text gets at least one example, and every template with priority placeholders gets enough examples
+        to cover their values.  The rest are split in proportion to the unique combinations each template has left,
+        so no combination is repeated until every template has run out of them.
+
+        :param num: The number of examples
+        :return: list - The number of examples of each template
+        """
         # ensure that priority grammars are moved up the list
-        for parser in self.text_parsers:
+        for parser in self.parser_map.values():
             parser.ensure_priority_combinations(num)
 
-        for index in range(num):
-            text = self.choose_text()
-            parser = self.parser_map[text]
-            yield text, self.get_parser_combination(parser)
+        important = set(self.texts.important)
+        combinators = [parser.combinator for parser in self.parser_map.values()]
+        minimums = [max(len(combinator.front), int(text in important))
+                    for text, combinator in zip(self.parser_map, combinators)]
+        return allocate(num, [c.available for c in combinators], [c.count for c in combinators], minimums)
+
+    def get_scheduler(self, num) -> tuple:
+        """
+        Get the scheduler that picks the template of each example, see `get_quotas`.
+
+        :param num: The number of examples
+        :return: tuple - The templates (in the order of `parser_map`), and the `TemplateScheduler` that locates the
+         examples (its templates are indexes into them)
+        """
+        return list(self.parser_map.values()), TemplateScheduler(self.get_quotas(num), self.random)
+
+    def get_min_combinations(self) -> int:
+        """
+        Get the number of examples that are needed to represent every value of the priority placeholders, and every
+        important text.
+
+        :return: int - The minimum number of examples
+        """
+        min_combos = sum([parser.combinator.get_min_combinations() for parser in self.text_parsers])
+        return min_combos + self.texts.important_count
+
+    def get_combination_batches(self, num, batch_size=batch.BATCH_SIZE, start=0, stop=None):
+        """
+        Draw the combinations a batch at a time.  The templates of a whole batch are looked up in a single vectorized
+        call, and then the combinations of each template in another one.  The combinations are exactly the same ones
+        (in the same order) as `get_combinations` would give.  Requires NumPy.
+
+        :param num: The number of combinations
+        :param batch_size: The number of combinations per batch
+        :param start: The position of the first combination
+        :param stop: The position to stop at (defaults to `num`)
+        :return: generator - For each batch, an array with the index (in `parser_map`) of the template of every
+         example, and a matrix for every template that has a row for each of its examples, in order
+        """
+        np = batch.import_numpy()
+        stop = num if stop is None else min(stop, num)
+
+        parsers, scheduler = self.get_scheduler(num)
+        for offset in range(start, stop, batch_size):
+            positions = np.arange(offset, min(offset + batch_size, stop), dtype=np.uint64)
+            picks, ranks = scheduler.locate_batch(positions)
+            picks = picks.astype(np.intp)
+            matrices = [parser.combinator.handed_batch(ranks[picks == index]) for index, parser in enumerate(parsers)]
+            yield picks, matrices
+
+    def get_renderings(self, start=0, stop=None, spans=True):
+        """
+        Render every combination of every template in order, see `exhaustive`.  Each template's combinations are
+        rendered incrementally by `TextParser.render_all`, and the templates that are entirely outside of the slice
+        are skipped.
+
+        :param start: The position of the first rendering
+        :param stop: The position to stop at (defaults to every combination)
+        :param spans: Whether to work out the spans of the placeholders
+        :return: generator - The renderings, in the order of `get_combinations`
+        """
+        offset = 0
+        for parser in self.parser_map.values():
+            if stop is not None and offset >= stop:
+                return
+            count = parser.combinator.count
+            if start < offset + count:
+                yield from parser.render_all(self.grammars, max(start - offset, 0),
+                                             None if stop is None else stop - offset, spans)
+            offset += count
 
     def _get_minimum_num(self, num):
+        if self.exhaustive:
+            return sum(parser.combinator.count for parser in self.parser_map.values())
+
+        if self.coverage:
+            return self.get_coverage_count()
+
         if num == 0:
             num = self.get_possible_combination_count()
 
-        min_combos = sum([parser.combinator.get_min_combinations() for parser in self.text_parsers])
-        min_combos += self.texts.important_count
+        min_combos = self.get_min_combinations()
         if num < min_combos:
             logger.warning(f"Number of generated examples increased due to priority grammars to {min_combos}")
             return min_combos
         return num
 
-    def sentences(self, num=1, combinations=None):
+    def is_duplicate(self, text: str) -> bool:
+        """
+        Check if an example's text was generated before (by this intent, or one that shares its duplicate filter).
+        The text is added to the filter, and counted if it's a duplicate.
+
+        :param text: The text of the example
+        :return: bool - True if the example should be dropped
+        """
+        if self.dedup is None or self.dedup.add(text):
+            return False
+        self.duplicates += 1
+        return True
+
+    def sentences(self, num=1, combinations=None, start=0, stop=None):
+        """
+        Generate the text of the examples, without working out their entities.  The sentences are rendered one at a
+        time, in the same order (and with the same text) as the examples, and duplicates are dropped if the intent
+        has a duplicate filter (only within the slice, the sentences before `start` are never rendered).
+
+        :param num: The number of sentences to generate
+        :param combinations: The combinations to render, as a dict of text -> combinations (drawn if None)
+        :param start: The position of the first sentence to render
+        :param stop: The position to stop at (defaults to `num`)
+        :return: generator - The sentences
+        """
         num = self._get_minimum_num(num)
 
+        if combinations is None and self.exhaustive:
+            for rendering in self.get_renderings(start, stop, spans=False):
+                if not self.is_duplicate(rendering.text):
+                    yield rendering.text
+            return
+
         if combinations is None:
-            combinations = defaultdict(set)
-            for text, seq in self.get_combinations(num):
-                combinations[text].add(seq)
+            for text, seq in self.get_combinations(num, start, stop):
+                sentence = self.parser_map[text].process(seq, self.grammars)
+                if not self.is_duplicate(sentence):
+                    yield sentence
+            return
 
         for text, seqs in combinations.items():
             if seqs:
                 for seq in seqs:
                     parser = self.parser_map[text]
-                    yield parser.process(seq, self.grammars)
-            else:
+                    sentence = parser.process(seq, self.grammars)
+                    if not self.is_duplicate(sentence):
+                        yield sentence
+            elif not self.is_duplicate(text):
                 yield text
 
-    def _run_down_queue(self, is_entity=False):
-        retries = {}
-        # process grammars that were probably not loaded in time
-        while not self.grammar_queue.empty():
-            data = None
-            try:
-                data = self.grammar_queue.get()
-                self.process_grammars(data, is_entity=is_entity, raise_on_error=True)
-            except PlaceholderError as err:
-                if self.grammar_queue.empty():
-                    # exhausted all options...
-                    raise err
-                else:
-                    for n in data.keys():
-                        if n in retries:
-                            retries[n] += 1
-                        else:
-                            retries[n] = 1
-                        if retries[n] > 3:
-                            raise err
-                    self.grammar_queue.put(data)
-
     def load(self, intent_data):
         # self.domain = intent_data['domain']
         self.texts = Texts()
         self.texts.load(intent_data['text'])
 
-        # grammars
-        self.process_grammars(intent_data['grammars'])
-        try:
-            self._run_down_queue()
-        except PlaceholderError as err:
-            logger.warning(f"{err}. Seeing if it's in entities...")
-        self.process_grammars(intent_data['entities'], is_entity=True)
-        self._run_down_queue(is_entity=True)
+        self.load_grammars(intent_data['grammars'], intent_data['entities'])
 
         # Get all the synonyms
         for grammar in self.grammars.values():
             self.synonyms.update(grammar.synonyms)
 
         for text in self.texts.available:
-            self.text_parsers.append(TextParser(text, self.grammars))
+            self.text_parsers.append(TextParser(text, self.grammars, self.get_random(text)))
             self.parser_map[text] = self.text_parsers[-1]
 
         # special case: if the grammar list is empty, remove the placeholder from the sentence
@@ -184,41 +357,70 @@ class Intent:
 
         return self
 
-    def process_grammars(self, data, is_entity=False, raise_on_error=False):
-        if isinstance(data, list):
-            for obj in data:
-                self.process_grammars(obj, is_entity)
-        else:
-            for name, value in data.items():
-                name = name.strip(PATTERN_RESERVED_CHARS)
-                try:
-                    # TODO: Entities with the same name will overwrite the grammar...
-                    self.grammars[name] = Grammar(name, self, is_entity)
-                    self.grammars[name].load_data(value)
-
-                    if is_entity:
-                        self.entities[name] = self.grammars[name]
-                except PlaceholderError as err:
-                    if raise_on_error:
-                        err.grammar_name = name
-                        raise err
-                    self.grammar_queue.put(data)
-
-    def choose_text(self) -> str:
-        try:
-            return next(self.texts.get())
-        except StopIteration:
-            return self.texts.get_used()
+    def load_grammars(self, grammars, entities):
+        """
+        Load the grammars and the entities.  The grammars they refer to are found up front, and they are loaded in
+        dependency order (in a single pass), so they can be declared in any order.  The grammars come from the
+        `library`, so a grammar that is included by many intents is only expanded (and held in memory) once.
+
+        :param grammars: The yaml data of the grammars
+        :param entities: The yaml data of the entities
+        :return: None
+        """
+        definitions = OrderedDict()  # name -> (yaml data, is entity, the dict it's declared in)
+        for data, is_entity in ((grammars, False), (entities, True)):
+            for name, value, owner in iter_definitions(data):
+                # TODO: Entities with the same name will overwrite the grammar...
+                definitions[name] = (value, is_entity, owner)
+
+        dependencies = OrderedDict()
+        for name, (value, is_entity, owner) in definitions.items():
+            references = get_references(value)
+            for reference, template in references.items():
+                if reference not in definitions:
+                    raise PlaceholderError(grammar_name=reference, placeholder_text=template)
+            dependencies[name] = references
+            # keep the order the grammars are declared in
+            self.grammars[name] = None
+
+        for name in topological_order(dependencies):
+            value, is_entity, owner = definitions[name]
+            grammars = OrderedDict((reference, self.grammars[reference]) for reference in dependencies[name])
+            self.grammars[name] = self.library.get(name, value, is_entity, grammars, self.seed, owner)
+
+        for name, (value, is_entity, owner) in definitions.items():
+            if is_entity:
+                self.entities[name] = self.grammars[name]
+
+    def share_grammars(self):
+        """
+        Swap the grammars for the copies in the library (i.e. after the intent was loaded from a snapshot, which has
+        its own copy of every grammar).  The dict is updated in place, so the templates use the shared grammars.
+
+        :return: None
+        """
+        for name, grammar in self.grammars.items():
+            self.grammars[name] = self.library.intern(grammar)
+        for name in self.entities:
+            self.entities[name] = self.grammars[name]
 
 
 class RasaNLUIntent(Intent):
-    def __init__(self, intent_name):
-        super().__init__(intent_name)
-        self.synonyms_used = {}
+    def __init__(self, intent_name, seed=None):
+        super().__init__(intent_name, seed)
+        self.synonyms_used = OrderedDict()  # synonym name -> its values, in the order they were first used
+        self.partial_synonyms = {}  # synonym name -> the values used so far, for synonyms too big to copy
         self.training_examples = []
         self.testing_examples = []
 
-    def process(self, num=0, test_ratio=0):
+    def get_counts(self, num=0, test_ratio=0):
+        """
+        Split the number of examples to generate into training and testing examples.
+
+        :param num: The number of examples requested
+        :param test_ratio: The percentage of examples that should be used for testing
+        :return: tuple - The total, training and testing counts
+        """
         num = self._get_minimum_num(num)
         testing_count = math.ceil(num * (test_ratio / 100))
         training_count = num - testing_count
@@ -226,14 +428,49 @@ class RasaNLUIntent(Intent):
         if testing_count:
             logger.info(
                 f"Processing {self.name} with {num} examples ({testing_count} testing)")
+        return num, training_count, testing_count
+
+    def process(self, num=0, test_ratio=0):
+        num, training_count, testing_count = self.get_counts(num, test_ratio)
 
-        for index, example in enumerate(self.examples(num)):
-            self.synonyms_used.update(example.synonyms_used)
+        for index, rendering in enumerate(self.get_example_renderings(num)):
+            # duplicates are dropped before their synonyms are recorded
+            if self.is_duplicate(rendering.text):
+                continue
+            example = self.make_example(rendering)
             if index >= training_count:
                 self.testing_examples.append(example)
             else:
                 self.training_examples.append(example)
 
+    def write(self, training: RasaNLUWriter, testing: RasaNLUWriter = None, num=0, test_ratio=0, shard=None):
+        """
+        Generate the examples and stream them straight into the writers, without holding on to them.
+
+        :param training: The writer that receives the training examples
+        :param testing: The writer that receives the testing examples (they are dropped if None)
+        :param num: The number of examples to generate
+        :param test_ratio: The percentage of examples that should be used for testing
+        :param shard: Only generate this shard's slice of the examples (see `chatter.utils.shard.parse_shard`).
+         Duplicates are only dropped within the shard, since the other shards' examples are never rendered here.
+        :return: None
+        """
+        num, training_count, testing_count = self.get_counts(num, test_ratio)
+        start, stop = shard_range(num, shard)
+
+        # duplicates are dropped without moving the other examples, so they stay in the same split (and shard)
+        for index, rendering in enumerate(self.get_example_renderings(num, start, stop), start):
+            if self.is_duplicate(rendering.text):
+                continue
+            writer = testing if index >= training_count else training
+            if writer is not None:
+                writer.write(self.make_example(rendering).to_dict())
+
+        entity_synonyms = self.entity_synonyms()
+        for writer in (training, testing):
+            if writer is not None:
+                writer.close(entity_synonyms)
+
     def json(self, test=False):
         if test is True:
             example_dicts = [e.to_dict() for e in self.testing_examples]
@@ -248,14 +485,74 @@ class RasaNLUIntent(Intent):
             ))
         return json.dumps(rv, indent=2)
 
+    def use_synonym(self, name, values, value=None):
+        """
+        Record that a synonym was used by an example.  The values are only copied (without duplicates) the first time
+        a synonym is used, the examples just keep its name.  Synonyms with lazy values (i.e. big expansions) are
+        never copied, only the values that the examples use are recorded.
+
+        :param name: The synonym name (the canonical value)
+        :param values: The values of the synonym
+        :param value: The value the example uses
+        :return: None
+        """
+        if name not in self.synonyms_used:
+            if getattr(values, 'is_lazy', False):
+                self.synonyms_used[name] = []
+                self.partial_synonyms[name] = set()
+            else:
+                self.synonyms_used[name] = list(OrderedDict.fromkeys(values))
+
+        used = self.partial_synonyms.get(name)
+        if used is not None and value is not None and value not in used:
+            used.add(value)
+            self.synonyms_used[name].append(value)
+
     def entity_synonyms(self):
         return [dict(value=name, synonyms=value) for name, value in self.synonyms_used.items()]
 
-    def examples(self, num=0, combinations=None):
-        num = self._get_minimum_num(num)
+    def examples(self, num=0, combinations=None, start=0, stop=None):
+        """
+        Generate the examples.
+
+        Only the combinations of the slice are drawn, and the examples of a slice are exactly the ones that a run
+        without a slice would produce at the same positions (see `get_combinations`).
+
+        :param num: The number of examples to generate
+        :param combinations: Reserved for pre-picked combinations
+        :param start: The position of the first example to render
+        :param stop: The position to stop at (defaults to `num`)
+        :return: generator - The examples
+        """
         if combinations is None:
-            for text, seq in self.get_combinations(num):
-                parser = self.parser_map[text]
-                example = CommonExample(self)
-                example.process(parser, seq)
-                yield example
+            for rendering in self.get_example_renderings(num, start, stop):
+                yield self.make_example(rendering)
+
+    def get_example_renderings(self, num=0, start=0, stop=None):
+        """
+        Render the text and spans of the examples, without building the examples (see `examples`), so duplicates
+        can be dropped before anything about them is recorded.
+
+        :param num: The number of examples to generate
+        :param start: The position of the first example to render
+        :param stop: The position to stop at (defaults to `num`)
+        :return: generator - The `chatter.parser.Rendering` of each example
+        """
+        num = self._get_minimum_num(num)
+        if self.exhaustive:
+            yield from self.get_renderings(start, stop)
+            return
+
+        for text, seq in self.get_combinations(num, start, stop):
+            yield self.parser_map[text].render(seq, self.grammars)
+
+    def make_example(self, rendering) -> CommonExample:
+        """
+        Build an example from its rendering, and record the synonyms it uses.
+
+        :param rendering: The `chatter.parser.Rendering` of the example
+        :return: CommonExample - The example
+        """
+        example = CommonExample(self)
+        example.process_rendering(rendering)
+        return example
@@ -0,0 +1,99 @@
+import itertools
+import logging
+import random
+from bisect import bisect_right
+
+from chatter.utils.permutation import Permutation
+
+logger = logging.getLogger(__name__)
+
+
+def largest_remainder(total: int, weights: list) -> list:
+    """
+    Split `total` into integer shares in proportion to the weights.  Each share is rounded down, and the units that
+    are left over go to the shares with the largest remainders (the earliest one wins a tie).
+
+    :param total: The amount to split
+    :param weights: The weight of each share (they may be bigger than fit in a float)
+    :return: list - The shares, they add up to `total`
+    """
+    weight = sum(weights)
+    if not weight:
+        return [0] * len(weights)
+
+    shares = [total * w // weight for w in weights]
+    remainders = [total * w % weight for w in weights]
+    leftover = total - sum(shares)
+    for index in sorted(range(len(weights)), key=lambda i: -remainders[i])[:leftover]:
+        shares[index] += 1
+    return shares
+
+
+def allocate(num: int, available: list, counts: list, minimums: list) -> list:
+    """
+    Split the examples across the templates in proportion to the unique combinations they have left, so no template
+    repeats a combination while another one still has unused ones.  Only once every unique combination has been
+    allocated, the rest are split in proportion to the total number of combinations of each template.
+
+    :param num: The number of examples
+    :param available: The number of unused combinations of each template
+    :param counts: The total number of combinations of each template
+    :param minimums: The number of examples each template needs at least (i.e. to cover its priority values)
+    :return: list - The number of examples of each template
+    """
+    quotas = list(minimums)
+    remaining = num - sum(quotas)
+    if remaining <= 0:
+        return quotas
+
+    unused = [max(a - q, 0) for a, q in zip(available, quotas)]
+    if remaining <= sum(unused):
+        shares = largest_remainder(remaining, unused)
+    else:
+        repeats = remaining - sum(unused)
+        logger.info(f"Repeating {repeats} combinations, every unique combination has been used")
+        shares = [u + s for u, s in zip(unused, largest_remainder(repeats, counts))]
+    return [q + s for q, s in zip(quotas, shares)]
+
+
+class TemplateScheduler:
+    """
+    Decides which template each example is rendered from.  The number of examples of each template is fixed up front
+    (see `allocate`), and the examples are laid out template by template and then shuffled by a keyed permutation.
+    So the template of any position (and which of that template's examples it is) can be looked up directly, in
+    constant time, and a slice of the examples never has to walk the positions before it.
+    """
+
+    def __init__(self, quotas: list, rng: random.Random = None):
+        self.quotas = quotas
+        self.random = rng or random.Random()
+        self.offsets = [0] + list(itertools.accumulate(quotas))
+        self.total = self.offsets[-1]
+        self.permutation = Permutation(self.total, self.random)
+
+    def locate(self, position: int) -> tuple:
+        """
+        Look up the example at a position.
+
+        :param position: The position of the example, from 0 to the total of the quotas - 1
+        :return: tuple - The index of its template, and which of the template's examples it is
+        """
+        value = self.permutation[position]
+        template = bisect_right(self.offsets, value) - 1
+        return template, value - self.offsets[template]
+
+    def locate_batch(self, positions) -> tuple:
+        """
+        Look up many positions at once, see `locate`.  Requires NumPy.
+
+        :param positions: The positions of the examples
+        :return: tuple - An array with the index of the template of each example, and an array with which of the
+         template's examples it is
+        """
+        from chatter.utils import batch
+        np = batch.import_numpy()
+
+        values = batch.permute(self.permutation, positions)
+        offsets = np.array(self.offsets, dtype=values.dtype)
+        templates = np.searchsorted(offsets, values, side='right') - 1
+        return templates, values - offsets[templates]
@@ -0,0 +1,129 @@
+import logging
+import os
+import pickle
+import tempfile
+
+from chatter import __version__
+from chatter.utils.digest import list_digest
+from chatter.utils.files import replace_file
+
+logger = logging.getLogger(__name__)
+
+# bump this whenever the layout of the compiled intents changes, so older snapshots are ignored
+SNAPSHOT_VERSION = 4
+
+
+def snapshot_key(source_digest: str, intent_name: str, seed=None) -> str:
+    """
+    Get the key of an intent's snapshot.
+
+    :param source_digest: The digest of the intent's file and every file it includes
+    :param intent_name: The name of the intent
+    :param seed: The seed the intent is generated with (the expanded grammars depend on it)
+    :return: str - The key
+    """
+    return list_digest([str(SNAPSHOT_VERSION), __version__, source_digest, intent_name, repr(seed)])
+
+
+def source_key(filename: str) -> str:
+    """
+    Get the key of the record of an intent file (see `SnapshotCache.load_source`).
+
+    :param filename: The intent file
+    :return: str - The key
+    """
+    return list_digest([str(SNAPSHOT_VERSION), __version__, 'source', os.path.abspath(filename)])
+
+
+class SnapshotCache:
+    """
+    Compiled intents (their texts, expanded grammars, synonym indexes and placeholder layouts), pickled to a
+    directory, so an intent whose sources haven't changed doesn't have to be compiled again.
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.hits = 0
+        self.misses = 0
+
+    def _get_filename(self, key) -> str:
+        return os.path.join(self.dirname, key + ".pickle")
+
+    def _read(self, filename):
+        try:
+            with open(filename, 'rb') as fp:
+                return pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as err:
+            logger.warning(f"Ignoring the broken snapshot {filename}: {err}")
+            return None
+
+    def _write(self, filename, obj):
+        os.makedirs(self.dirname, exist_ok=True)
+
+        # written to a temporary file first, so other processes never see half a snapshot
+        fd, tmp_filename = tempfile.mkstemp(prefix=".", suffix=".pickle", dir=self.dirname)
+        try:
+            with open(fd, 'wb') as fp:
+                pickle.dump(obj, fp, pickle.HIGHEST_PROTOCOL)
+            replace_file(tmp_filename, filename)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
+
+    def exists(self, key) -> bool:
+        """
+        Check if there is a snapshot, without loading it.
+
+        :param key: The key of the snapshot (see `snapshot_key`)
+        :return: bool - True if there is one
+        """
+        return os.path.exists(self._get_filename(key))
+
+    def load(self, key):
+        """
+        Load a compiled intent.
+
+        :param key: The key of the snapshot (see `snapshot_key`)
+        :return: Intent - The intent, or None if there isn't a (usable) snapshot
+        """
+        intent = self._read(self._get_filename(key))
+        if intent is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return intent
+
+    def save(self, key, intent):
+        """
+        Save a compiled intent.  It must be saved before any examples are generated from it.
+
+        :param key: The key of the snapshot (see `snapshot_key`)
+        :param intent: The intent
+        :return: None
+        """
+        self._write(self._get_filename(key), intent)
+
+    def load_source(self, filename):
+        """
+        Load the record of an intent file: the files it includes, the digest of all of them, and the names of its
+        intents.  If the digest still matches, the intents can be loaded from their snapshots without parsing the
+        file at all.
+
+        :param filename: The intent file
+        :return: dict - The record, or None if the file has no record
+        """
+        return self._read(self._get_filename(source_key(filename)))
+
+    def save_source(self, filename, includes: list, digest: str, names: list):
+        """
+        Save the record of an intent file, see `load_source`.
+
+        :param filename: The intent file
+        :param includes: The absolute paths of every file it includes
+        :param digest: The digest of the file and every file it includes
+        :param names: The names of its intents, in order
+        :return: None
+        """
+        self._write(self._get_filename(source_key(filename)), dict(includes=includes, digest=digest, names=names))
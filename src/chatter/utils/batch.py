@@ -0,0 +1,107 @@
+"""
+Vectorized versions of the combination helpers, to draw many combinations in one call.
+
+NumPy is an optional dependency, so it's only imported once a batch is actually drawn.  Every function gives exactly
+the same values as its scalar counterpart in `chatter.utils.permutation`.
+"""
+
+BATCH_SIZE = 4096
+
+# the vectorized Feistel network works in uint64, so the two halves can be at most 32 bits wide
+MAX_HALF_BITS = 32
+
+_numpy = None
+
+
+def import_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("Drawing combinations in batches requires NumPy (pip install chatter[numpy])")
+        _numpy = numpy
+    return _numpy
+
+
+def has_numpy() -> bool:
+    try:
+        import_numpy()
+    except ImportError:
+        return False
+    return True
+
+
+def fits(permutation) -> bool:
+    """
+    Check if a permutation can be vectorized, its domain has to fit in 64 bits.
+    """
+    return permutation.half_bits <= MAX_HALF_BITS
+
+
+def _encrypt(permutation, values):
+    np = import_numpy()
+    half_bits = np.uint64(permutation.half_bits)
+    half_mask = np.uint64(permutation.half_mask)
+    full_mask = np.uint64(permutation.full_mask)
+    m1, m2 = (np.uint64(m) for m in permutation.multipliers)
+
+    # uint64 products wrap around modulo 2^64, so masking them gives the same result as the scalar round function
+    left, right = values >> half_bits, values & half_mask
+    for key in permutation.keys:
+        value = ((right ^ np.uint64(key)) * m1) & full_mask
+        value ^= value >> half_bits
+        value = (value * m2) & full_mask
+        left, right = right, left ^ (value >> half_bits)
+    return (left << half_bits) | right
+
+
+def permute(permutation, positions):
+    """
+    Look up many positions of a permutation at once.
+
+    :param permutation: A `chatter.utils.permutation.Permutation`
+    :param positions: The positions to look up
+    :return: numpy.ndarray - The permuted values (uint64, or Python ints if the domain doesn't fit in 64 bits)
+    """
+    np = import_numpy()
+    if not fits(permutation):
+        return np.array([permutation[int(position)] for position in positions], dtype=object)
+
+    values = _encrypt(permutation, np.asarray(positions, dtype=np.uint64))
+    size = np.uint64(permutation.size - 1)
+    # cycle walk the values that fell outside of the domain, until every one of them is inside
+    outside = np.flatnonzero(values > size)
+    while len(outside):
+        values[outside] = _encrypt(permutation, values[outside])
+        outside = outside[values[outside] > size]
+    return values
+
+
+def decode_mixed_radix(values, radices: list):
+    """
+    Decode many integers into digits at once, see `chatter.utils.permutation.decode_mixed_radix`.
+
+    :param values: The integers to decode
+    :param radices: The base of each digit
+    :return: numpy.ndarray - A (len(values), len(radices)) matrix of digits
+    """
+    np = import_numpy()
+    values = np.asarray(values)
+    digits = np.empty((len(values), len(radices)), dtype=values.dtype)
+    for index in range(len(radices) - 1, -1, -1):
+        radix = np.uint64(radices[index]) if values.dtype == np.uint64 else radices[index]
+        digits[:, index] = values % radix
+        values = values // radix
+    return digits
+
+
+def combinations(combinator, positions):
+    """
+    Get the combinations at many positions of a combinator's order at once.
+
+    :param combinator: A `chatter.combinator.Combinator`
+    :param positions: The positions
+    :return: numpy.ndarray - A (len(positions), n_placeholders) matrix of combination indexes
+    """
+    return decode_mixed_radix(permute(combinator.permutation, positions), combinator.radices)
@@ -0,0 +1,210 @@
+import itertools
+import logging
+from collections import defaultdict
+
+from chatter.utils import batch
+
+logger = logging.getLogger(__name__)
+
+
+def parse_coverage(value: str) -> int:
+    """
+    Parse a coverage strength, either ``pairwise`` or ``t=N``.
+
+    :param value: The strength
+    :return: int - The number of placeholders whose values are covered together
+    """
+    value = value.strip().lower()
+    if value == 'pairwise':
+        return 2
+
+    name, _, strength = value.partition('=')
+    if name.strip() != 't' or not strength.strip().isdigit() or int(strength) < 1:
+        raise ValueError(f"Invalid coverage {value!r}, use pairwise or t=N (with N of at least 1)")
+    return int(strength)
+
+
+def _product(values) -> int:
+    total = 1
+    for value in values:
+        total *= value
+    return total
+
+
+def _set_bits(uncovered, start: int, stop: int) -> list:
+    """
+    Get the tuples of a bitmap that are still uncovered.
+
+    :param uncovered: The bitmaps of every subset (see `covering_array`)
+    :param start: Where the subset's bitmap starts
+    :param stop: Where it stops
+    :return: list - The indexes of the uncovered tuples, relative to `start`
+    """
+    if isinstance(uncovered, bytearray):
+        return [index for index, bit in enumerate(uncovered[start:stop]) if bit]
+    return batch.import_numpy().flatnonzero(uncovered[start:stop]).tolist()
+
+
+def _best_value(uncovered, bases: list, size: int) -> int:
+    """
+    Find the value of the new column that covers the most uncovered tuples of a row (the first one on a tie).
+
+    :param uncovered: The bitmaps of every subset (see `covering_array`)
+    :param bases: Where the tuples of the row start in the bitmaps, one for every subset the row has values for
+    :param size: The number of values of the new column
+    :return: int - The value
+    """
+    if not bases:
+        return 0
+
+    if isinstance(uncovered, bytearray):
+        best, best_gain = 0, -1
+        for value in range(size):
+            gain = sum(uncovered[base + value] for base in bases)
+            if gain > best_gain:
+                best, best_gain = value, gain
+        return best
+
+    # the gains of every value at once, from a (bases x values) window into the bitmaps
+    np = batch.import_numpy()
+    window = np.array(bases, dtype=np.intp)[:, None] + np.arange(size, dtype=np.intp)
+    return int(uncovered[window].sum(axis=0).argmax())
+
+
+def covering_array(radices: list, strength: int) -> list:
+    """
+    Build a covering array: a list of combinations in which every combination of values of any `strength`
+    placeholders appears at least once.
+
+    This uses IPOG (in-parameter-order-general): it starts with every combination of the first `strength` columns,
+    and adds the other columns one at a time.  Each new column first gets the value that covers the most uncovered
+    tuples in every existing row (horizontal growth), and the tuples that are still uncovered then get rows of their
+    own, which are shared as much as possible (vertical growth).  The result is close to minimal, and the memory used
+    is bounded by the number of tuples of a single column.
+
+    When NumPy is available, the gains of every value of the new column are worked out in a single vectorized call
+    per row.  The rows of the vertical growth are indexed by the cells they have fixed, so finding a row that can
+    take an uncovered tuple doesn't scan all of them.
+
+    :param radices: The number of values of each placeholder
+    :param strength: The number of placeholders whose values are covered together (2 for pairwise)
+    :return: list - The combinations
+    """
+    if any(radix <= 0 for radix in radices):
+        return []
+    strength = min(strength, len(radices))
+
+    # IPOG gives smaller arrays when the biggest columns come first
+    order = sorted(range(len(radices)), key=lambda index: -radices[index])
+    sizes = [radices[index] for index in order]
+
+    rows = [list(row) for row in itertools.product(*[range(size) for size in sizes[:strength]])]
+    for column in range(strength, len(sizes)):
+        size = sizes[column]
+        subsets = list(itertools.combinations(range(column), strength - 1))
+        # one bitmap of uncovered tuples per subset of the earlier columns, indexed by the subset's values and then
+        # the new column's value.  They are laid out one after the other, each one starting at `starts[subset]`
+        starts = [0]
+        for subset in subsets:
+            starts.append(starts[-1] + _product(sizes[index] for index in subset) * size)
+        if batch.has_numpy():
+            np = batch.import_numpy()
+            uncovered = np.ones(starts[-1], dtype=np.uint8)
+        else:
+            uncovered = bytearray(b'\x01') * starts[-1]
+        strides = [[_product(sizes[index] for index in subset[position + 1:]) for position in range(len(subset))]
+                   for subset in subsets]
+
+        def offset(row, subset_index):
+            total = 0
+            for index, stride in zip(subsets[subset_index], strides[subset_index]):
+                if row[index] is None:
+                    return None
+                total += row[index] * stride
+            return starts[subset_index] + total * size
+
+        # horizontal growth
+        for row in rows:
+            bases = [base for base in (offset(row, subset_index) for subset_index in range(len(subsets)))
+                     if base is not None]
+            best = _best_value(uncovered, bases, size)
+            row.append(best)
+            for base in bases:
+                uncovered[base + best] = 0
+
+            # cells that were left open by an earlier vertical growth get the value that covers the most tuples
+            for cell in [index for index in range(column) if row[index] is None]:
+                touching = [subset_index for subset_index, subset in enumerate(subsets) if cell in subset]
+                best_cell, best_gain = None, 0
+                for value in range(sizes[cell]):
+                    row[cell] = value
+                    gain = 0
+                    for subset_index in touching:
+                        base = offset(row, subset_index)
+                        if base is not None:
+                            gain += uncovered[base + best]
+                    if gain > best_gain:
+                        best_cell, best_gain = value, gain
+                row[cell] = best_cell
+                if best_cell is not None:
+                    for subset_index in touching:
+                        base = offset(row, subset_index)
+                        if base is not None:
+                            uncovered[base + best] = 0
+
+        # vertical growth.  The new rows are indexed by their value of the new column and one of their other cells,
+        # either by the cell's value once it's fixed, or as open while it's still None
+        extra = []
+        fixed_rows = defaultdict(dict)  # (value, cell, cell value) -> the rows, by id
+        open_rows = defaultdict(dict)  # (value, cell) -> the rows, by id
+        for subset_index, subset in enumerate(subsets):
+            start = starts[subset_index]
+            for index in _set_bits(uncovered, start, starts[subset_index + 1]):
+                if not uncovered[start + index]:
+                    continue
+                values = []
+                rest, value = divmod(index, size)
+                for stride in strides[subset_index]:
+                    digit, rest = divmod(rest, stride)
+                    values.append(digit)
+
+                row = None
+                if subset:
+                    # only the rows that agree on the first cell of the subset can take the tuple
+                    cell, cell_value = subset[0], values[0]
+                    candidates = itertools.chain(fixed_rows[value, cell, cell_value].values(),
+                                                 open_rows[value, cell].values())
+                    for candidate in candidates:
+                        if all(candidate[c] is None or candidate[c] == v for c, v in zip(subset[1:], values[1:])):
+                            row = candidate
+                            break
+                if row is None:
+                    row = [None] * column + [value]
+                    extra.append(row)
+                    for cell in range(column):
+                        open_rows[value, cell][id(row)] = row
+                for c, v in zip(subset, values):
+                    if row[c] is None:
+                        row[c] = v
+                        del open_rows[value, c][id(row)]
+                        fixed_rows[value, c, v][id(row)] = row
+                # the row may now cover tuples of other subsets too
+                for other_index in range(len(subsets)):
+                    base = offset(row, other_index)
+                    if base is not None:
+                        uncovered[base + value] = 0
+        rows.extend(extra)
+
+    # the cells that don't matter are filled in with the first value, and the columns are put back in order
+    rv = []
+    seen = set()
+    for row in rows:
+        row = tuple(0 if value is None else value for value in row)
+        if row in seen:
+            continue
+        seen.add(row)
+        combination = [0] * len(radices)
+        for position, index in enumerate(order):
+            combination[index] = row[position]
+        rv.append(combination)
+    return rv
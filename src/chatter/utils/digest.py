@@ -29,6 +29,21 @@ def hash_digest(data: Dict[str, str]):
     return hash.hexdigest()
 
 
+def file_digest(filename: str, chunk_size: int = 1 << 20):
+    """
+    Get the digest of a file's content, read a chunk at a time so big files aren't loaded into memory.
+
+    :param filename: The file
+    :param chunk_size: The number of bytes read at a time
+    :return: str - The digest
+    """
+    hash = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
 def str_digest(text: str):
     hash = hashlib.sha1()
     hash.update(text.encode('utf-8'))
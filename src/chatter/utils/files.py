@@ -0,0 +1,20 @@
+import os
+
+
+def _get_umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def replace_file(tmp_filename, filename):
+    """
+    Move a finished temporary file (i.e. from `tempfile.mkstemp`) over `filename`, in one atomic step.  The file gets
+    the permissions a newly created file would have, rather than the private ones of a temporary file.
+
+    :param tmp_filename: The temporary file
+    :param filename: The file to replace
+    :return: None
+    """
+    os.chmod(tmp_filename, 0o666 & ~_get_umask())
+    os.replace(tmp_filename, filename)
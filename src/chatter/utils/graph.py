@@ -0,0 +1,40 @@
+from chatter.exceptions import CycleError
+
+_VISITING = 1
+_DONE = 2
+
+
+def topological_order(dependencies: dict) -> list:
+    """
+    Order the nodes of a graph so every node comes after the nodes it depends on.  The graph is walked depth first
+    without recursion, so it takes time linear in its size and works for chains of any depth.  Nodes that don't
+    depend on each other keep the order they have in `dependencies`.
+
+    :param dependencies: The nodes that each node depends on (dependencies that aren't nodes themselves are ignored)
+    :return: list - The nodes
+    """
+    order = []
+    state = {}
+    for root in dependencies:
+        if root in state:
+            continue
+
+        state[root] = _VISITING
+        stack = [(root, iter(dependencies[root]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child not in dependencies:
+                    continue
+                if child not in state:
+                    state[child] = _VISITING
+                    stack.append((child, iter(dependencies[child])))
+                    break
+                if state[child] == _VISITING:
+                    path = [name for name, _ in stack]
+                    raise CycleError(path[path.index(child):] + [child])
+            else:
+                stack.pop()
+                state[node] = _DONE
+                order.append(node)
+    return order
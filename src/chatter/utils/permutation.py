@@ -0,0 +1,102 @@
+import random
+
+# Odd multipliers used by the round function (golden ratio and murmur3 finalizer constants)
+MULTIPLIER_1 = 0x9E3779B97F4A7C15
+MULTIPLIER_2 = 0xC2B2AE3D27D4EB4F
+ROUNDS = 4
+
+
+class Permutation:
+    """
+    A keyed, bijective permutation over ``range(size)``.
+
+    This is a small balanced Feistel network over the smallest even bit width that covers `size`, with cycle walking
+    to stay inside the domain.  Since the Feistel domain is less than ``4 * size``, a lookup needs fewer than four
+    rounds of walking on average, so both time and memory per lookup are constant, no matter how large `size` gets.
+    """
+
+    def __init__(self, size: int, rng: random.Random = None):
+        if rng is None:
+            rng = random
+
+        self.size = size
+        self.half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.half_mask = (1 << self.half_bits) - 1
+        self.full_mask = (1 << (2 * self.half_bits)) - 1
+        self.multipliers = (MULTIPLIER_1 & self.full_mask | 1, MULTIPLIER_2 & self.full_mask | 1)
+        self.keys = [rng.getrandbits(self.half_bits) for _ in range(ROUNDS)]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position: int) -> int:
+        if not 0 <= position < self.size:
+            raise IndexError(f"Permutation index out of range: {position}")
+
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def index(self, value: int) -> int:
+        """
+        The inverse of a lookup: get the position that a value is at.
+
+        :param value: The value, from 0 to size - 1
+        :return: int - The position
+        """
+        if not 0 <= value < self.size:
+            raise ValueError(f"Permutation value out of range: {value}")
+
+        position = self._decrypt(value)
+        while position >= self.size:
+            position = self._decrypt(position)
+        return position
+
+    def _round(self, value: int, key: int) -> int:
+        m1, m2 = self.multipliers
+        value = ((value ^ key) * m1) & self.full_mask
+        value ^= value >> self.half_bits
+        value = (value * m2) & self.full_mask
+        return value >> self.half_bits
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self.half_bits) | right
+
+    def _decrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in reversed(self.keys):
+            left, right = right ^ self._round(left, key), left
+        return (left << self.half_bits) | right
+
+
+def decode_mixed_radix(value: int, radices: list) -> list:
+    """
+    Decode an integer into a list of digits, where the first digit is the most significant.  This is the same
+    ordering that `itertools.product` uses.
+
+    :param value: The integer to decode (must be less than the product of the radices)
+    :param radices: The base of each digit
+    :return: list - The digits
+    """
+    digits = [0] * len(radices)
+    for index in range(len(radices) - 1, -1, -1):
+        value, digits[index] = divmod(value, radices[index])
+    return digits
+
+
+def encode_mixed_radix(digits: list, radices: list) -> int:
+    """
+    The inverse of :func:`decode_mixed_radix`.
+
+    :param digits: The digits, most significant first
+    :param radices: The base of each digit
+    :return: int - The encoded integer
+    """
+    value = 0
+    for digit, radix in zip(digits, radices):
+        value = value * radix + digit
+    return value
@@ -0,0 +1,15 @@
+import random
+
+
+def derive_random(seed=None, *names) -> random.Random:
+    """
+    Get a random number generator for a named part of a run.  Generators derived from the same seed and names always
+    produce the same stream, no matter which process or machine they are created on, or in what order.
+
+    :param seed: The seed of the run, or None for an unpredictable stream
+    :param names: The names that identify the stream (i.e. the intent name and template text)
+    :return: random.Random - The generator
+    """
+    if seed is None:
+        return random.Random()
+    return random.Random(":".join([str(seed)] + [str(name) for name in names]))
@@ -0,0 +1,31 @@
+def parse_shard(text: str) -> tuple:
+    """
+    Parse a shard specification such as ``2/4`` (the second of four shards).
+
+    :param text: The shard specification
+    :return: tuple - The (1 based) shard number, and the number of shards
+    """
+    try:
+        index, count = [int(x) for x in text.split('/')]
+    except ValueError:
+        raise ValueError(f"Shards must look like i/N, got: {text}")
+
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard number must be between 1 and {count}, got: {index}")
+    return index, count
+
+
+def shard_range(count: int, shard: tuple = None) -> tuple:
+    """
+    Get the slice of `count` items that belongs to a shard.  The slices of all the shards are contiguous and
+    disjoint, so concatenating them in shard order gives back all `count` items.
+
+    :param count: The total number of items
+    :param shard: The shard, as returned by `parse_shard`, or None for everything
+    :return: tuple - The start and stop of the shard's slice
+    """
+    if shard is None:
+        return 0, count
+
+    index, n_shards = shard
+    return (index - 1) * count // n_shards, index * count // n_shards
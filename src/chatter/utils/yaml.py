@@ -1,19 +1,130 @@
+import logging
 import os
 from collections import OrderedDict
 
 import yaml
 
+from chatter.choices import ValueFile
+from chatter.utils.digest import file_digest
 
-class YamlLoader(yaml.SafeLoader):
+try:
+    # the libyaml parser is a lot faster, but isn't always available
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader
 
-    def __init__(self, stream):
+logger = logging.getLogger(__name__)
+
+
+class IncludeCache:
+    """
+    Parsed ``!include`` files, keyed by their absolute path and modification time, so a file that is included many
+    times (i.e. by every intent file) is only read and parsed once.  The same goes for the ``!values`` files, which
+    are indexed once and then shared.
+
+    The cached data is shared by everything that includes the file, so it must not be modified.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.value_files = {}
+        self.digests = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(filename) -> tuple:
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        return filename, stat.st_mtime_ns, stat.st_size
+
+    def load(self, filename):
+        return self.resolve(filename)[0]
+
+    def resolve(self, filename) -> tuple:
+        """
+        Load an included file.
+
+        :param filename: The file to load
+        :return: tuple - The data, and the absolute paths of the files it includes in turn
+        """
+        key = self._key(filename)
+
+        if key in self.entries:
+            self.hits += 1
+        else:
+            self.misses += 1
+            with open(key[0], 'r') as f:
+                loader = YamlLoader(f, self)
+                try:
+                    self.entries[key] = (loader.get_single_data(), loader.includes)
+                finally:
+                    loader.dispose()
+        return self.entries[key]
+
+    def values(self, filename, column: str = None) -> ValueFile:
+        """
+        Open an external file of values.
+
+        :param filename: The file
+        :param column: The column to use, for csv files
+        :return: ValueFile - The values
+        """
+        key = self._key(filename) + (column,)
+        if key not in self.value_files:
+            self.value_files[key] = ValueFile(key[0], column)
+        return self.value_files[key]
+
+    def digest(self, filename) -> str:
+        """
+        Get the digest of a file's content.
+
+        :param filename: The file
+        :return: str - The digest
+        """
+        key = self._key(filename)
+        if key not in self.digests:
+            self.digests[key] = file_digest(key[0])
+        return self.digests[key]
+
+
+class YamlLoader(SafeLoader):
+
+    def __init__(self, stream, cache: IncludeCache = None):
         self._root = os.path.dirname(stream.name)
+        self.cache = cache if cache is not None else IncludeCache()
+        self.includes = []  # every file included while loading, directly or not
         super().__init__(stream)
 
     def include(self, node):
-        filename = os.path.join(self._root, self.construct_scalar(node))
-        with open(filename, 'r') as f:
-            return yaml.load(f, YamlLoader)
+        filename = os.path.abspath(os.path.join(self._root, self.construct_scalar(node)))
+        data, includes = self.cache.resolve(filename)
+        for name in [filename] + includes:
+            if name not in self.includes:
+                self.includes.append(name)
+        return data
+
+    def values(self, node):
+        """
+        Load the values of an external file, either ``!values cities.txt`` (one value per line), or
+        ``!values {file: products.csv, column: name}`` (a column of a csv file, the first one by default).
+        """
+        if isinstance(node, yaml.MappingNode):
+            options = self.construct_mapping(node)
+            filename, column = options.get('file'), options.get('column')
+        else:
+            filename, column = self.construct_scalar(node), None
+        if not filename:
+            raise yaml.constructor.ConstructorError(None, None, "!values needs a file", node.start_mark)
+
+        filename = os.path.abspath(os.path.join(self._root, filename))
+        try:
+            values = self.cache.values(filename, None if column is None else str(column))
+        except (OSError, ValueError) as err:
+            raise yaml.constructor.ConstructorError(None, None, f"Can't load the values: {err}", node.start_mark)
+        if filename not in self.includes:
+            self.includes.append(filename)
+        return values
 
 
 def _ordered_dict(loader, node):
@@ -23,12 +134,28 @@ def _ordered_dict(loader, node):
 
 
 YamlLoader.add_constructor('!include', YamlLoader.include)
+YamlLoader.add_constructor('!values', YamlLoader.values)
 YamlLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _ordered_dict)
 
 
-def load_yaml(stream):
-    with open(stream, 'r') as fp:
-        data = list(yaml.load_all(fp, YamlLoader))
-    return data
+def load_yaml(stream, cache: IncludeCache = None, includes: list = None):
+    """
+    Load all the documents of a yaml file.
 
+    :param stream: The filename
+    :param cache: The cache to resolve includes with, so they can be shared between files
+    :param includes: If given, the absolute paths of every file the documents include are added to it
+    :return: list - The documents
+    """
+    with open(stream, 'r') as fp:
+        loader = YamlLoader(fp, cache)
+        try:
+            data = []
+            while loader.check_data():
+                data.append(loader.get_data())
+        finally:
+            loader.dispose()
 
+    if includes is not None:
+        includes.extend(loader.includes)
+    return data
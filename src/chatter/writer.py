@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import tempfile
+
+from chatter.utils.files import replace_file
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 1024 * 1024
+INDENT = 2
+
+
+def _dump(obj, level: int) -> str:
+    """
+    Serialize `obj` the same way ``json.dumps(indent=2)`` would, as if it was nested `level` deep in a document.
+    """
+    text = json.dumps(obj, indent=INDENT)
+    return text.replace("\n", "\n" + " " * (INDENT * level))
+
+
+class RasaNLUWriter:
+    """
+    Incrementally writes a ``rasa_nlu_data`` document through a buffered file.
+
+    Examples are serialized and written as they are handed over, so memory stays flat no matter how many examples are
+    written.  The entity synonyms are only known once every example has been seen, so they are written last, when
+    the writer is closed.
+
+    The document is written to a temporary file that only replaces `filename` once it's complete, so the file never
+    holds half a document.
+    """
+
+    def __init__(self, filename, regex_features: list = None, buffer_size: int = BUFFER_SIZE):
+        self.filename = filename
+        self.regex_features = regex_features or []
+        self.buffer_size = buffer_size
+        self.count = 0
+        self.fp = None
+        self.tmp_filename = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.discard()
+        elif not self.closed:
+            self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.fp is None or self.fp.closed
+
+    def open(self):
+        dirname, basename = os.path.split(os.path.abspath(self.filename))
+        fd, self.tmp_filename = tempfile.mkstemp(prefix=f".{basename}.", dir=dirname)
+        self.fp = open(fd, 'w', buffering=self.buffer_size)
+        self.fp.write('{\n  "rasa_nlu_data": {\n')
+        self.fp.write(f'    "regex_features": {_dump(self.regex_features, 2)},\n')
+        self.fp.write('    "common_examples": [')
+        return self
+
+    def write(self, example: dict):
+        """
+        Write a single common example.
+
+        :param example: The example, as returned by `CommonExample.to_dict`
+        :return: None
+        """
+        self.fp.write(",\n      " if self.count else "\n      ")
+        self.fp.write(_dump(example, 3))
+        self.count += 1
+
+    def close(self, entity_synonyms: list = None):
+        """
+        Finish the document and close the file.
+
+        :param entity_synonyms: The entity synonyms that were used by the written examples
+        :return: None
+        """
+        self.fp.write("\n    ],\n" if self.count else "],\n")
+        self.fp.write(f'    "entity_synonyms": {_dump(entity_synonyms or [], 2)}\n')
+        self.fp.write("  }\n}")
+        self.fp.close()
+        replace_file(self.tmp_filename, self.filename)
+        logger.debug(f"Wrote {self.count} examples to {self.filename}")
+
+    def discard(self):
+        """
+        Close the file without finishing the document, leaving `filename` untouched.
+
+        :return: None
+        """
+        if not self.closed:
+            self.fp.close()
+        if self.tmp_filename is not None and os.path.exists(self.tmp_filename):
+            os.remove(self.tmp_filename)
@@ -0,0 +1,45 @@
+import os
+import shutil
+from collections import OrderedDict
+
+import pytest
+
+from chatter.loader import RasaNLULoader
+from chatter.placeholder import PlaceHolder
+from chatter.rasa_nlu import RasaNLUIntent
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+
+
+@pytest.fixture()
+def intent_dir(tmpdir):
+    dirname = str(tmpdir.join('intents'))
+    shutil.copytree(os.path.join(HERE, 'test_data'), dirname)
+
+    with open(os.path.join(dirname, 'restaurant_search.yml')) as fp:
+        data = fp.read()
+    for name in ['find_restaurant', 'order_food']:
+        with open(os.path.join(dirname, f'{name}.yml'), 'w') as fp:
+            fp.write(data.replace('restaurant_search:', f'{name}:'))
+    return dirname
+
+
+def load_intent(grammars, entities, text=("{greetings} {locations}",), seed=1):
+    data = OrderedDict(text=list(text), grammars=grammars, entities=entities)
+    return RasaNLUIntent('intent', seed).load(data)
+
+
+def make_placeholders(*ranges):
+    placeholders = []
+    for index, index_range in enumerate(ranges):
+        p = PlaceHolder(f"{{name{index}}}")
+        p.index_range = index_range
+        placeholders.append(p)
+    return placeholders
+
+
+def export(path, outdir, **kwargs):
+    loader = RasaNLULoader(30, 20, streaming=True, **kwargs)
+    loader.load(path)
+    loader.export(os.path.join(outdir, 'train'), os.path.join(outdir, 'test'))
+    return loader
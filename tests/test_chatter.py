@@ -19,3 +19,66 @@ def test_generate():
     assert result.output.startswith('Generating RASA NLU data for examples/restaurant_search.yml')
     assert 'restaurant_search.json' in result.output
     assert result.exit_code == 0
+
+
+def test_stats(tmpdir):
+    filename = str(tmpdir.join('intent.yml'))
+    with open(filename, 'w') as fp:
+        fp.write("""
+numbers:
+  text:
+    - "{greetings>} {number} {number} {number}"
+    - "{greetings} {manners?}"
+  grammars:
+    - greetings: [hi, hello, howdy]
+    - manners: [please, thanks]
+    - digit: ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
+    - number: ['{digit}{digit}{digit}{digit}{digit}{digit}']
+  entities: []
+""")
+    runner = CliRunner()
+    result = runner.invoke(cli, ['stats', filename])
+
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert ['numbers', '2', str(3 * 10 ** 18 + 9), '4'] in [line.split() for line in lines]
+    assert any(line.endswith('greetings (3)') and str(3 * 10 ** 18) in line for line in lines)
+    # the placeholders and combinations (counting the left out optional placeholder as a choice)
+    assert ['2', '9'] in [line.split()[-2:] for line in lines if '{manners?}' in line]
+
+
+def test_sentences_to_stdout(tmpdir):
+    outfile = str(tmpdir.join('sentences.txt'))
+    runner = CliRunner()
+    args = ['generate', 'sentences', 'tests/test_data/restaurant_search.yml', '--num=50', '--seed=3']
+    piped = runner.invoke(cli, args + ['-'])
+    saved = runner.invoke(cli, args + [outfile])
+
+    assert piped.exit_code == 0 and saved.exit_code == 0
+    with open(outfile) as fp:
+        assert piped.stdout == fp.read()
+    assert len(piped.stdout.splitlines()) == 50
+
+
+def test_sentences_without_duplicates(tmpdir):
+    filename = str(tmpdir.join('intent.yml'))
+    with open(filename, 'w') as fp:
+        fp.write("""
+greet:
+  text:
+    - "{greetings} {name?}"
+  grammars:
+    - greetings: [hi, hello, hi]
+    - name: [bob, '']
+  entities: []
+""")
+    runner = CliRunner()
+    args = ['generate', 'sentences', filename, '--num=9', '--seed=3', '-']
+    result = runner.invoke(cli, args + ['--dedup', 'exact'])
+
+    assert result.exit_code == 0
+    assert sorted(result.stdout.splitlines()) == ['hello', 'hello bob', 'hi', 'hi bob']
+    assert "Dropped 5 duplicate sentences" in result.stderr
+
+    result = runner.invoke(cli, args + ['--dedup', 'exact', '--jobs', '2'])
+    assert result.exit_code != 0 and 'single process' in result.output
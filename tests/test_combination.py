@@ -4,7 +4,9 @@ from glob import glob
 
 import pytest
 
+from chatter.grammar import Grammar
 from chatter.parser import TextParser
+from chatter.utils.permutation import decode_mixed_radix
 from chatter.utils.yaml import load_yaml
 
 HERE = os.path.abspath(os.path.dirname(__file__))
@@ -55,3 +57,45 @@ def test_combination(grammars, text, answer):
         parser.set(name, grammars[name][0])
 
     assert parser.text == answer
+
+
+def make_grammars(**choices):
+    rv = {}
+    for name, values in choices.items():
+        rv[name] = Grammar(name)
+        rv[name].choices = values
+    return rv
+
+
+render_data = [
+    ("{a} {b} {c}", [0, 0, 0], "hi there you"),
+    ("  {a}   and {b}{c}? ", [1, 2, 1], "hello and lol!?"),
+    ("{a} {b} {c}", [0, 2, 0], "hi you"),
+    ("{b} x {b}", [2, 2], "x"),
+]
+
+
+@pytest.mark.parametrize("text,combination,answer", render_data)
+def test_render_spans(text, combination, answer):
+    grammars = make_grammars(a=["hi", "hello"], b=["there", "and", ""], c=["you", "lol!"])
+    parser = TextParser(text, grammars)
+    rendering = parser.render(combination, grammars)
+
+    assert rendering.text == answer == parser.process(combination, grammars)
+    assert [span.name for span in rendering.spans] == parser.names
+    for span in rendering.spans:
+        assert rendering.text[span.start:span.end] == span.value
+
+
+@pytest.mark.parametrize("text", ["{a} {b} {c}", "  {a}   and {b?}{c?}? ", "{b} x {b}", "{a?} {c?}", "no placeholders"])
+def test_render_all_matches_render(text):
+    grammars = make_grammars(a=["hi", "hello"], b=["there", "and", ""], c=["you", "lol!"])
+    parser = TextParser(text, grammars)
+    radices = parser.combinator.radices
+    expected = [parser.render(decode_mixed_radix(index, radices), grammars)
+                for index in range(parser.possible_combinations)]
+
+    assert list(parser.render_all(grammars)) == expected
+    assert list(parser.render_all(grammars, start=2, stop=5)) == expected[2:5]
+    assert [r.text for r in parser.render_all(grammars, spans=False)] == [r.text for r in expected]
+    assert list(parser.render_all(grammars, start=len(expected))) == []
@@ -0,0 +1,60 @@
+import itertools
+import random
+
+import pytest
+
+from chatter.combinator import Combinator
+from chatter.utils.permutation import Permutation
+
+from conftest import make_placeholders
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 7, 64, 1000, 4097])
+def test_permutation_is_bijective(size):
+    permutation = Permutation(size)
+    assert sorted(permutation[i] for i in range(size)) == list(range(size))
+    assert [permutation.index(permutation[i]) for i in range(size)] == list(range(size))
+
+
+@pytest.mark.parametrize("ranges", [(3,), (2, 5), (4, 1, 3), (7, 11, 2)])
+def test_combinator_returns_every_combination_once(ranges):
+    combinator = Combinator(make_placeholders(*ranges))
+    combinations = [tuple(combinator.get()) for _ in range(combinator.count)]
+
+    assert sorted(combinations) == list(itertools.product(*[range(r) for r in ranges]))
+    assert combinator.get() is None
+    assert tuple(combinator.get_used()) in combinations
+
+
+def test_handed_combinations_are_addressable():
+    front = [[0, 0, 0], [1, 2, 3], [2, 3, 4]]
+    combinator = Combinator(make_placeholders(3, 4, 5), random.Random(2))
+    combinator.set_front(front)
+    expected = [combinator.get() for _ in range(combinator.count)]
+
+    assert expected[:3] == front
+    assert [combinator.handed(index) for index in range(combinator.count)] == expected
+    # once every combination was handed out, they repeat in the same order
+    assert combinator.handed(combinator.count + 4) == expected[4]
+
+
+def test_combinator_huge_space():
+    ranges = (10 ** 6, 10 ** 6, 10 ** 6, 10 ** 6)
+    combinator = Combinator(make_placeholders(*ranges))
+    assert combinator.count == 10 ** 24
+
+    combinations = [tuple(combinator.get()) for _ in range(1000)]
+    assert len(set(combinations)) == 1000
+    assert all(0 <= value < 10 ** 6 for combination in combinations for value in combination)
+
+
+@pytest.mark.parametrize("ranges", [(3,), (7, 11, 2), (10 ** 6, 10 ** 6), (10 ** 12, 10 ** 12)],
+                         ids=['tiny', 'small', '40 bits', 'over 64 bits'])
+def test_batches_match_scalar_combinations(ranges):
+    pytest.importorskip('numpy')
+    combinator = Combinator(make_placeholders(*ranges), random.Random(3))
+    combinator.set_front([[1] * len(ranges), [2] * len(ranges)])
+
+    indexes = list(range(min(combinator.count, 500))) + [combinator.count - 1, combinator.count + 1]
+    expected = [combinator.handed(index) for index in indexes]
+    assert combinator.handed_batch(indexes).tolist() == expected
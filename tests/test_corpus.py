@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from chatter.corpus import Corpus
+from chatter.loader import RasaNLULoader
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+INTENT_FILE = os.path.join(HERE, 'test_data', 'restaurant_search.yml')
+
+
+def load(**kwargs):
+    loader = RasaNLULoader(200, streaming=True, seed=5, **kwargs)
+    loader.load(INTENT_FILE)
+    return loader
+
+
+@pytest.fixture()
+def corpus(tmpdir):
+    filename = str(tmpdir.join('corpus.bin'))
+    assert load().export_corpus(filename) == 200
+    with Corpus(filename) as corpus:
+        yield corpus
+
+
+def test_corpus_renders_the_same_examples(corpus):
+    intent, = load().iter_intents()
+    expected = [example.to_dict() for example in intent.examples(200)]
+
+    assert len(corpus) == 200
+    assert [example.to_dict() for example in corpus] == expected
+    assert [example.to_dict() for example in corpus[150:160]] == expected[150:160]
+    assert corpus[-1].to_dict() == expected[-1]
+    with pytest.raises(IndexError):
+        corpus[200]
+
+
+def test_corpus_records_are_compact(corpus):
+    template_id, combination, omitted = corpus.record(3)
+    parser = corpus.templates[template_id]
+
+    assert len(combination) == len(parser.placeholders)
+    assert all(0 <= index < radix for index, radix in zip(combination, parser.combinator.radices))
+    assert omitted == parser.combinator.optional_mask(combination)
+    # a template id, and a few bytes of combination per example
+    assert corpus.record_size == 4 + 2
+    assert os.path.getsize(corpus.filename) == corpus.offset + 200 * corpus.record_size
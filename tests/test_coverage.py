@@ -0,0 +1,94 @@
+import itertools
+from collections import OrderedDict
+
+import pytest
+
+from chatter.combinator import Combinator
+from chatter.rasa_nlu import RasaNLUIntent
+from chatter.utils.coverage import covering_array, parse_coverage
+
+from conftest import make_placeholders
+
+
+def uncovered_tuples(rows, radices, strength):
+    missing = []
+    for columns in itertools.combinations(range(len(radices)), min(strength, len(radices))):
+        seen = set(tuple(row[c] for c in columns) for row in rows)
+        missing.extend(values for values in itertools.product(*[range(radices[c]) for c in columns])
+                       if values not in seen)
+    return missing
+
+
+@pytest.mark.parametrize("radices, strength, max_rows", [
+    ([3, 3, 3, 3], 2, 10),
+    ([2] * 10, 2, 12),
+    ([10, 10, 10], 2, 120),
+    ([4, 3, 2, 5, 6], 3, 130),
+    ([7, 1, 3], 2, 21),
+    ([5], 2, 5),
+    ([2] * 6, 1, 2),
+])
+def test_covering_array(radices, strength, max_rows):
+    rows = covering_array(radices, strength)
+
+    assert not uncovered_tuples(rows, radices, strength)
+    assert len(rows) <= max_rows
+    assert len(set(map(tuple, rows))) == len(rows)
+
+
+@pytest.mark.parametrize("radices, strength", [([20, 20, 20, 20, 20], 2), ([6, 5, 4, 3, 3, 2], 3)])
+def test_covering_array_without_numpy(monkeypatch, radices, strength):
+    pytest.importorskip('numpy')
+    expected = covering_array(radices, strength)
+
+    monkeypatch.setattr('chatter.utils.batch.has_numpy', lambda: False)
+    assert covering_array(radices, strength) == expected
+
+@pytest.mark.parametrize("value, strength", [("pairwise", 2), ("t=3", 3), (" T=1 ", 1)])
+def test_parse_coverage(value, strength):
+    assert parse_coverage(value) == strength
+
+
+@pytest.mark.parametrize("value", ["t=0", "t=x", "triples", "3"])
+def test_parse_invalid_coverage(value):
+    with pytest.raises(ValueError):
+        parse_coverage(value)
+
+
+def test_priority_values_come_first():
+    placeholders = make_placeholders(4, 6, 3)
+    placeholders[1].priority = placeholders[2].priority = True
+    combinator = Combinator(placeholders)
+    combinator.ensure_priorities(6)
+
+    first = [combinator.get() for _ in range(6)]
+    assert set(c[1] for c in first) == set(range(6))
+    assert set(c[2] for c in first) == set(range(3))
+
+    # and every combination is still handed out exactly once
+    rest = [combinator.get() for _ in range(combinator.available)]
+    assert combinator.get() is None
+    assert sorted(map(tuple, first + rest)) == list(itertools.product(range(4), range(6), range(3)))
+
+
+def test_pairwise_examples_cover_every_pair():
+    data = OrderedDict(
+        text=["{greetings} I want {food} {time}", "{greetings}"],
+        grammars=[
+            OrderedDict(greetings=['hi', 'hello', 'hey']),
+            OrderedDict(food=['pizza', 'tacos', 'sushi', 'pasta']),
+            OrderedDict(time=['now', 'later', 'tonight']),
+        ],
+        entities=[])
+    intent = RasaNLUIntent('intent', seed=1).load(data)
+    intent.set_coverage(2)
+
+    sentences = list(intent.sentences(1000))
+    assert len(sentences) == intent.get_coverage_count() < 3 * 4 * 3 + 3
+    assert len(set(sentences)) == len(sentences)
+
+    rows = [sentence.split(' I want ') for sentence in sentences if ' I want ' in sentence]
+    rows = [[greeting] + rest.split(' ') for greeting, rest in rows]
+    values = [data['grammars'][i][name] for i, name in enumerate(['greetings', 'food', 'time'])]
+    indexes = [[values[c].index(value) for c, value in enumerate(row)] for row in rows]
+    assert not uncovered_tuples(indexes, [3, 4, 3], 2)
@@ -0,0 +1,137 @@
+import json
+import os
+
+import pytest
+
+from chatter.dedup import BloomFilter, ExactFilter, parse_dedup
+from chatter.loader import RasaNLULoader
+
+from conftest import export
+
+
+@pytest.mark.parametrize("value, spec", [
+    ("exact", ('exact', None)),
+    (" Bloom ", ('bloom', 10 ** 7)),
+    ("bloom=5000", ('bloom', 5000)),
+])
+def test_parse_dedup(value, spec):
+    assert parse_dedup(value) == spec
+
+
+@pytest.mark.parametrize("value", ["bloom=0", "bloom=x", "cuckoo", "exact=3"])
+def test_parse_invalid_dedup(value):
+    with pytest.raises(ValueError):
+        parse_dedup(value)
+
+
+@pytest.mark.parametrize("make", [ExactFilter, lambda: BloomFilter(20000)])
+def test_filters_drop_every_duplicate(make):
+    texts = [f"sentence {i}" for i in range(10000)]
+    text_filter = make()
+
+    added = [text_filter.add(text) for text in texts]
+    assert all(not text_filter.add(text) for text in texts)
+    assert all(text in text_filter for text in texts)
+    # a bloom filter may drop a few unique texts too, but never more than its error rate allows
+    assert sum(added) >= len(texts) * 0.995
+    assert text_filter.rejected == len(texts) * 2 - sum(added)
+
+
+def test_bloom_filter_has_a_fixed_size():
+    bloom = BloomFilter(1000)
+    size = len(bloom.bits)
+    for i in range(5000):
+        bloom.add(str(i))
+
+    # about 1.44 * log2(1 / error rate) bits per text
+    assert len(bloom.bits) == size < 1000 * 15 / 8
+    assert bloom.hashes == 10
+
+
+# the same sentence can be rendered from different combinations, and both intents render the same sentences
+REPEATED = """
+greet:
+  text:
+    - "{greetings} {name?}"
+  grammars:
+    - greetings: [hi, hello, hi]
+    - name: [bob, '']
+  entities: []
+welcome:
+  text:
+    - "{greetings} {name?}"
+  grammars:
+    - greetings: [hello, hi]
+    - name: [bob]
+  entities: []
+"""
+
+
+def test_sentences_are_unique_across_intents(tmpdir):
+    filename = str(tmpdir.join('repeated.yml'))
+    with open(filename, 'w') as fp:
+        fp.write(REPEATED)
+
+    loader = RasaNLULoader(0, streaming=True, seed=1, dedup=('exact', None))
+    loader.load(filename)
+    outfile = str(tmpdir.join('sentences.txt'))
+    loader.export_sentences(outfile)
+
+    with open(outfile) as fp:
+        sentences = fp.read().splitlines()
+    assert sorted(sentences) == ['hello', 'hello bob', 'hi', 'hi bob']
+    # 9 combinations of the first intent, and 4 of the second
+    assert loader.duplicates == 9 + 4 - 4
+
+
+def test_examples_are_unique_within_each_intent(intent_dir, tmpdir):
+    outdir = str(tmpdir.join('out'))
+    loader = export(intent_dir, outdir, seed=3, jobs=2, dedup=('bloom', 1000), dedup_scope='intent')
+
+    total = 0
+    for name in ['find_restaurant', 'order_food', 'restaurant_search']:
+        texts = []
+        for subdir in ['train', 'test']:
+            with open(os.path.join(outdir, subdir, name + '.json')) as fp:
+                texts.extend(e['text'] for e in json.load(fp)['rasa_nlu_data']['common_examples'])
+        assert len(texts) == len(set(texts))
+        total += len(texts)
+    assert total + loader.duplicates == 90
+
+
+def test_dropping_across_intents_needs_a_single_process():
+    with pytest.raises(ValueError):
+        RasaNLULoader(10, streaming=True, jobs=2, dedup=('exact', None))
+
+
+# every example of the second intent is a duplicate, so it doesn't use any synonyms
+SYNONYMS = """
+greet:
+  text:
+    - "hi {name}"
+  grammars:
+    - bob: [robert, bobby]
+  entities:
+    - name: ["{bob}"]
+welcome:
+  text:
+    - "hi {name}"
+  grammars:
+    - bob: [robert, bobby]
+  entities:
+    - name: ["{bob}"]
+"""
+
+
+def test_synonyms_of_duplicates_are_not_recorded(tmpdir):
+    filename = str(tmpdir.join('synonyms.yml'))
+    with open(filename, 'w') as fp:
+        fp.write(SYNONYMS)
+
+    loader = RasaNLULoader(0, streaming=True, seed=1, dedup=('exact', None))
+    loader.load(filename)
+    loader.export(str(tmpdir.join('train')))
+
+    for name, synonyms in [('greet', [dict(value='bob', synonyms=['robert', 'bobby'])]), ('welcome', [])]:
+        with open(str(tmpdir.join('train', name + '.json'))) as fp:
+            assert json.load(fp)['rasa_nlu_data']['entity_synonyms'] == synonyms
@@ -0,0 +1,282 @@
+import gc
+import json
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+
+import pytest
+
+from chatter.exceptions import CycleError, PlaceholderError
+from chatter.library import GrammarLibrary
+from chatter.rasa_nlu import RasaNLUIntent
+from chatter.writer import RasaNLUWriter
+
+from conftest import load_intent
+
+
+@pytest.fixture()
+def intent():
+    return load_intent(
+        grammars=[
+            OrderedDict(greetings=['hi', 'hello']),
+            OrderedDict(city=['city', 'proper']),
+            OrderedDict([('New York', ['the big apple', 'New York {city?}'])]),
+            OrderedDict(Atlanta=['atlanta', 'the big apple']),
+        ],
+        entities=[
+            OrderedDict(locations=['{New York}', '{Atlanta}', 'the North of town']),
+        ])
+
+
+def test_synonym_index(intent):
+    locations = intent.grammars['locations']
+
+    assert locations.get_synonym('atlanta') == 'Atlanta'
+    assert locations.get_synonym('the North of town') is None
+    # the first synonym that has the value wins
+    assert locations.get_synonym('the big apple') == 'New York'
+    for value in intent.grammars['New York'].choices:
+        assert locations.get_synonym(value) == 'New York'
+
+
+def test_synonyms_of_examples(intent):
+    for example in intent.examples(20):
+        for entity in example.entities:
+            assert entity['entity'] == 'locations'
+            value = example.text[entity['start']:entity['end']]
+            assert entity['value'] == intent.grammars['locations'].get_synonym(value) or value
+
+
+def test_entity_synonyms_are_kept_once_per_intent(intent):
+    examples = list(intent.examples(30))
+    synonyms = intent.entity_synonyms()
+
+    names = [x['value'] for x in synonyms]
+    assert set(names) == set(name for example in examples for name in example.synonym_names)
+    for data in synonyms:
+        values = data['synonyms']
+        assert len(values) == len(set(values))
+        # examples only hold on to a reference
+        for example in examples:
+            if data['value'] in example.synonym_names:
+                assert example.synonyms[data['value']] is intent.synonyms_used[data['value']]
+
+
+def test_lazy_synonyms_only_record_the_values_used(tmpdir):
+    intent = load_intent(
+        text=["go to {place}"],
+        grammars=[OrderedDict([(name, [f"{name}{i}" for i in range(2000)])]) for name in 'abc'] +
+                 [OrderedDict(big=['{a} {b} {c}'])],
+        entities=[OrderedDict(place=['{big}'])])
+    assert intent.grammars['place'].choices.is_lazy
+
+    with RasaNLUWriter(str(tmpdir.join('training.json'))) as training:
+        intent.write(training, num=5)
+
+    with open(str(tmpdir.join('training.json'))) as fp:
+        data = json.load(fp)['rasa_nlu_data']
+    values = [entity['value'] for example in data['common_examples'] for entity in example['entities']]
+    assert values == ['big'] * 5
+    used = [example['text'][len('go to '):] for example in data['common_examples']]
+    assert data['entity_synonyms'] == [dict(value='big', synonyms=used)]
+
+
+def load_nested_intent(seed=1):
+    return load_intent(
+        text=["{greetings} {sentence}"],
+        grammars=[
+            OrderedDict(greetings=['hi', 'hello']),
+            OrderedDict(digit=[str(i) for i in range(10)]),
+            OrderedDict(number=['{digit}{digit}']),
+            OrderedDict(sentence=['{number} and {number?}', 'nothing']),
+        ],
+        entities=[OrderedDict(locations=['{number} main street'])],
+        seed=seed)
+
+
+def set_materialize_limit(monkeypatch, limit):
+    monkeypatch.setattr('chatter.grammar.MATERIALIZE_LIMIT', limit)
+    monkeypatch.setattr('chatter.choices.MATERIALIZE_LIMIT', limit)
+    # the grammars expanded with the old limit can't be shared
+    monkeypatch.setattr(RasaNLUIntent, 'library', GrammarLibrary())
+
+
+def test_lazy_choices_match_materialized(monkeypatch):
+    set_materialize_limit(monkeypatch, 10 ** 6)
+    eager = load_nested_intent()
+    set_materialize_limit(monkeypatch, 10)
+    lazy = load_nested_intent()
+
+    choices = lazy.grammars['sentence'].choices
+    assert choices.is_lazy
+    assert not eager.grammars['sentence'].choices.is_lazy
+    # the optional number can also be left out
+    assert choices.size == 100 * 101 + 1
+    for index in [0, 1, 1234, 10 ** 4 - 1, 10 ** 4, 100 * 101]:
+        assert choices[index] == eager.grammars['sentence'].choices[index]
+
+    assert [e.to_dict() for e in lazy.examples(50)] == [e.to_dict() for e in eager.examples(50)]
+
+
+def test_huge_nested_grammars_are_not_expanded():
+    intent = load_intent(
+        text=["{sentence}"],
+        grammars=[
+            OrderedDict(digit=[str(i) for i in range(10)]),
+            OrderedDict(number=['{digit}{digit}{digit}{digit}{digit}{digit}']),
+            OrderedDict(sentence=['{number} {number} {number}']),
+        ],
+        entities=[])
+
+    assert intent.get_possible_combination_count() == 10 ** 18
+    for example in intent.examples(10):
+        assert len(example.text.split()) == 3
+
+
+def test_batched_combinations_match_scalar(monkeypatch):
+    pytest.importorskip('numpy')
+
+    def examples():
+        # the first templates run out of combinations in the middle of a batch, and the last one is given twice
+        intent = load_intent(
+            text=["{greetings}", "{greetings} {city?}", "{greetings} {locations}", "{greetings} {locations}"],
+            grammars=[OrderedDict(greetings=['hi', 'hello']), OrderedDict(city=['city', 'proper'])],
+            entities=[OrderedDict(locations=[str(i) for i in range(100)])])
+        return [e.to_dict() for e in intent.examples(500)]
+
+    monkeypatch.setattr(RasaNLUIntent, 'batch_size', 0)
+    expected = examples()
+    monkeypatch.setattr(RasaNLUIntent, 'batch_size', 64)
+    assert examples() == expected
+
+
+def test_grammars_can_be_declared_in_any_order():
+    ordered = load_nested_intent()
+    shuffled = load_intent(
+        text=["{greetings} {sentence}"],
+        grammars=[
+            OrderedDict(sentence=['{number} and {number?}', 'nothing']),
+            OrderedDict(number=['{digit}{digit}']),
+            OrderedDict(greetings=['hi', 'hello']),
+            OrderedDict(digit=[str(i) for i in range(10)]),
+        ],
+        entities=[OrderedDict(locations=['{number} main street'])])
+
+    assert list(shuffled.grammars['sentence'].choices) == list(ordered.grammars['sentence'].choices)
+
+
+def test_grammars_can_refer_to_entities():
+    intent = load_intent(
+        text=["{greetings} {address}"],
+        grammars=[OrderedDict(greetings=['hi']), OrderedDict(address=['{street} {city}'])],
+        entities=[OrderedDict(street=['main street', 'high street']), OrderedDict(city=['paris'])])
+
+    assert set(intent.grammars['address'].choices) == {'main street paris', 'high street paris'}
+
+
+def test_deep_reference_chains():
+    depth = 2000
+    grammars = [OrderedDict([(f'g{i}', [f'{{g{i + 1}}}'])]) for i in range(depth)]
+    intent = load_intent(
+        text=["{greetings} {g0}"],
+        grammars=grammars + [OrderedDict(greetings=['hi']), OrderedDict([(f'g{depth}', ['end'])])],
+        entities=[])
+
+    assert list(intent.grammars['g0'].choices) == ['end']
+
+
+def test_grammar_cycles_are_reported():
+    with pytest.raises(CycleError) as info:
+        load_intent(
+            text=["{greetings} {a}"],
+            grammars=[OrderedDict(greetings=['hi']), OrderedDict(a=['{b}']), OrderedDict(b=['x {c}', 'y']),
+                      OrderedDict(c=['{a?} z'])],
+            entities=[])
+
+    assert info.value.cycle == ['a', 'b', 'c', 'a']
+    assert 'a -> b -> c -> a' in str(info.value)
+
+
+def test_missing_grammars_are_reported():
+    with pytest.raises(PlaceholderError) as info:
+        load_intent(text=["{greetings}"], grammars=[OrderedDict(greetings=['hi {nobody}'])], entities=[])
+
+    assert info.value.grammar_name == 'nobody'
+    assert info.value.placeholder_text == 'hi {nobody}'
+
+
+def test_grammars_are_shared_between_intents(monkeypatch):
+    library = GrammarLibrary()
+    monkeypatch.setattr(RasaNLUIntent, 'library', library)
+    greetings = ['hi', 'hello']
+    locations = ['{city} centre', 'the {city} suburbs']
+
+    first = load_intent(grammars=[OrderedDict(greetings=greetings), OrderedDict(city=['paris', 'rome'])],
+                        entities=[OrderedDict(locations=locations)])
+    second = load_intent(grammars=[OrderedDict(greetings=greetings), OrderedDict(city=['paris', 'rome'])],
+                         entities=[OrderedDict(locations=locations)])
+    # the same yaml, but it refers to a different grammar
+    other = load_intent(grammars=[OrderedDict(greetings=greetings), OrderedDict(city=['oslo'])],
+                        entities=[OrderedDict(locations=locations)])
+
+    for name in ['greetings', 'city', 'locations']:
+        assert first.grammars[name] is second.grammars[name]
+    assert other.grammars['greetings'] is first.grammars['greetings']
+    assert other.grammars['locations'] is not first.grammars['locations']
+    assert list(other.grammars['locations'].choices) == ['oslo centre', 'the oslo suburbs']
+    assert library.misses == 5
+    assert len(library) == 5
+
+    del first, second, other
+    gc.collect()
+    assert len(library) == 0
+    # the digests of the yaml data are dropped with the data
+    assert not library.digests
+
+
+def test_examples_are_compact(intent):
+    for example in intent.examples(20):
+        assert not hasattr(example, '__dict__')
+        assert all(not hasattr(span, '__dict__') for span in example.spans)
+        assert example.to_dict() == dict(text=example.text, intent='intent',
+                                         entities=[span.to_example() for span in example.spans])
+
+
+def test_rendering_from_many_threads(intent):
+    parser = intent.text_parsers[0]
+    combinations = [parser.combinator.combination(position) for position in range(parser.combinator.count)]
+    expected = [parser.render(combination, intent.grammars) for combination in combinations]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(20):
+            assert list(executor.map(lambda c: parser.render(c, intent.grammars), combinations)) == expected
+
+    for rendering in expected:
+        for span in rendering.spans:
+            assert rendering.text[span.start:span.end] == span.value
+
+
+def test_optional_placeholders_are_counted_as_a_choice():
+    intent = load_intent(
+        text=["{greetings} {city?} {manners?}"],
+        grammars=[OrderedDict(greetings=['hi', 'hello']), OrderedDict(city=['paris', 'rome']),
+                  OrderedDict(manners=['please'])],
+        entities=[])
+
+    assert intent.text_parsers[0].possible_combinations == 2 * 3 * 2
+    # every combination renders differently, so all the renderings are generated exactly once
+    sentences = list(intent.sentences(0))
+    assert len(sentences) == len(set(sentences)) == 12
+    assert {'hi', 'hello rome please', 'hi paris'} < set(sentences)
+
+
+def test_exhaustive_examples_follow_the_combinations(intent):
+    intent.exhaustive = True
+    combinations = list(intent.get_combinations(intent._get_minimum_num(5)))
+    assert len(combinations) == intent.get_possible_combination_count()
+
+    # the renderings are built incrementally, but they are the same as rendering each combination on its own
+    expected = [intent.parser_map[text].render(combination, intent.grammars) for text, combination in combinations]
+    examples = list(intent.examples(5))
+    assert [example.text for example in examples] == [rendering.text for rendering in expected]
+    assert [e.to_dict() for e in examples[3:]] == [e.to_dict() for e in intent.examples(0, start=3)]
+    assert list(intent.sentences(0)) == [example.text for example in examples]
@@ -0,0 +1,294 @@
+import filecmp
+import os
+import pickle
+from glob import glob
+
+import pytest
+
+from chatter.choices import ValueFile
+from chatter.library import GrammarLibrary
+from chatter.loader import RasaNLULoader
+from chatter.rasa_nlu import RasaNLUIntent
+
+from conftest import export
+
+
+def test_parallel_export_matches_serial(intent_dir, tmpdir):
+    serial = str(tmpdir.join('serial'))
+    parallel = str(tmpdir.join('parallel'))
+    export(intent_dir, serial, seed=7)
+    export(intent_dir, parallel, seed=7, jobs=3)
+
+    for subdir in ['train', 'test']:
+        names = sorted(name for name in os.listdir(os.path.join(serial, subdir)) if not name.startswith('.'))
+        assert names == ['find_restaurant.json', 'order_food.json', 'restaurant_search.json']
+
+        match, mismatch, errors = filecmp.cmpfiles(
+            os.path.join(serial, subdir), os.path.join(parallel, subdir), names, shallow=False)
+        assert match == names
+
+
+def test_parallel_sentences_match_serial(intent_dir, tmpdir):
+    outfiles = []
+    for jobs in [1, 3]:
+        loader = RasaNLULoader(30, streaming=True, jobs=jobs, seed=7)
+        loader.load(intent_dir)
+        outfiles.append(str(tmpdir.join(f'sentences{jobs}.txt')))
+        loader.export_sentences(outfiles[-1])
+
+    assert filecmp.cmp(*outfiles, shallow=False)
+    with open(outfiles[0]) as fp:
+        assert len(fp.readlines()) == 90
+    assert not [name for name in os.listdir(str(tmpdir)) if name.startswith('.')]
+
+
+def export_sentences(path, outfile, **kwargs):
+    loader = RasaNLULoader(40, streaming=True, seed=11, **kwargs)
+    loader.load(path)
+    loader.export_sentences(outfile)
+    with open(outfile) as fp:
+        return fp.read()
+
+
+def test_seeded_runs_are_reproducible(intent_dir, tmpdir):
+    first = export_sentences(intent_dir, str(tmpdir.join('first.txt')))
+    second = export_sentences(intent_dir, str(tmpdir.join('second.txt')))
+    assert first == second
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_shards_concatenate_to_full_run(intent_dir, tmpdir, jobs):
+    full = export_sentences(intent_dir, str(tmpdir.join('full.txt')))
+    shards = [export_sentences(intent_dir, str(tmpdir.join(f'shard{i}.txt')), shard=(i, 4), jobs=jobs)
+              for i in range(1, 5)]
+
+    assert all(shards)
+    assert "".join(shards) == full
+
+
+def test_includes_are_parsed_once(intent_dir):
+    loader = RasaNLULoader(streaming=True)
+    loader.load(intent_dir)
+
+    assert len(loader.tasks) == 3
+    # every intent file includes the same 6 files
+    assert loader.include_cache.misses == 6
+    assert loader.include_cache.hits == 12
+
+    # changing an included file invalidates it
+    filename = os.path.join(intent_dir, 'grammars', 'greetings.yml')
+    with open(filename, 'a') as fp:
+        fp.write("  - 'sup'\n")
+    loader.load(os.path.join(intent_dir, 'restaurant_search.yml'))
+    assert loader.include_cache.misses == 7
+    assert 'sup' in loader.tasks[-1][2]['grammars'][0]['greetings']
+
+
+def test_snapshots_are_reused_until_the_sources_change(intent_dir, tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    expected = export_sentences(intent_dir, str(tmpdir.join('expected.txt')))
+
+    for run in range(2):
+        loader = RasaNLULoader(40, streaming=True, seed=11, cache_dir=cache_dir)
+        loader.load(intent_dir)
+        outfile = str(tmpdir.join(f'run{run}.txt'))
+        loader.export_sentences(outfile)
+        with open(outfile) as fp:
+            assert fp.read() == expected
+        assert (loader.snapshots.hits, loader.snapshots.misses) == ((3, 0) if run else (0, 3))
+
+    assert all(os.stat(filename).st_mode & 0o777 == default_mode() for filename in glob(cache_dir + '/*.pickle'))
+
+    # changing an included file invalidates every intent that includes it
+    with open(os.path.join(intent_dir, 'grammars', 'greetings.yml'), 'a') as fp:
+        fp.write("  - 'sup'\n")
+    loader = RasaNLULoader(40, streaming=True, seed=11, cache_dir=cache_dir)
+    loader.load(intent_dir)
+    intents = list(loader.iter_intents())
+    assert loader.snapshots.misses == 3
+    assert all('sup' in intent.grammars['greetings'].choices for intent in intents)
+
+
+def test_snapshots_are_checked_before_parsing(intent_dir, tmpdir, monkeypatch):
+    cache_dir = str(tmpdir.join('cache'))
+    loader = RasaNLULoader(40, streaming=True, seed=11, cache_dir=cache_dir)
+    loader.load(intent_dir)
+    list(loader.iter_intents())
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The intent files shouldn't be parsed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr('chatter.loader.load_yaml', fail)
+        loader = RasaNLULoader(40, streaming=True, seed=11, cache_dir=cache_dir)
+        loader.load(intent_dir)
+        assert len(list(loader.iter_intents())) == 3
+        assert loader.snapshots.hits == 3
+
+    # the files are parsed after all if the snapshots are gone by the time the intents are built
+    loader = RasaNLULoader(40, streaming=True, seed=11, cache_dir=cache_dir)
+    loader.load(intent_dir)
+    assert all(task.data is None for task in loader.tasks)
+    for filename in glob(cache_dir + '/*.pickle'):
+        os.remove(filename)
+    assert len(list(loader.iter_intents())) == 3
+    assert loader.snapshots.misses == 3
+
+def test_intents_from_snapshots_share_their_grammars(intent_dir, tmpdir, monkeypatch):
+    cache_dir = str(tmpdir.join('cache'))
+    for run in range(2):
+        monkeypatch.setattr(RasaNLUIntent, 'library', GrammarLibrary())
+        loader = RasaNLULoader(40, streaming=True, seed=11, cache_dir=cache_dir)
+        loader.load(intent_dir)
+        intents = list(loader.iter_intents())
+        assert loader.snapshots.hits == (3 if run else 0)
+
+        first, *others = intents
+        for other in others:
+            for name in ['greetings', 'locations']:
+                assert other.grammars[name] is first.grammars[name]
+            assert other.entities['locations'] is first.grammars['locations']
+
+
+def test_streamed_intents_share_their_grammars(intent_dir, tmpdir, monkeypatch):
+    library = GrammarLibrary()
+    monkeypatch.setattr(RasaNLUIntent, 'library', library)
+    loader = export(intent_dir, str(tmpdir.join('out')), seed=7)
+
+    # the three intents are the same, so only the first one expands its grammars
+    n_grammars = len(loader.pinned_grammars)
+    assert (library.hits, library.misses) == (2 * n_grammars, n_grammars)
+
+
+def test_unchanged_outputs_are_not_regenerated(intent_dir, tmpdir):
+    outdir = str(tmpdir.join('out'))
+    stray = os.path.join(outdir, 'train', 'stale_intent.json')
+    export(intent_dir, outdir, seed=7)
+    open(stray, 'w').close()
+
+    mtimes = {}
+    for subdir in ['train', 'test']:
+        for filename in glob(os.path.join(outdir, subdir, '*.json')):
+            os.utime(filename, ns=(0, 0))
+            mtimes[filename] = 0
+
+    with open(os.path.join(intent_dir, 'order_food.yml'), 'a') as fp:
+        fp.write("\n")
+    export(intent_dir, outdir, seed=7)
+
+    # only the intent that changed is written again, and outputs that aren't generated any more are removed
+    changed = sorted(os.path.relpath(filename, outdir) for filename in mtimes
+                     if os.path.exists(filename) and os.stat(filename).st_mtime_ns != 0)
+    assert changed == ['test/order_food.json', 'train/order_food.json']
+    assert not os.path.exists(stray)
+
+    # and the outputs are the same as a fresh run's
+    fresh = str(tmpdir.join('fresh'))
+    export(intent_dir, fresh, seed=7)
+    for subdir in ['train', 'test']:
+        names = sorted(os.path.basename(name) for name in glob(os.path.join(fresh, subdir, '*.json')))
+        match, mismatch, errors = filecmp.cmpfiles(
+            os.path.join(fresh, subdir), os.path.join(outdir, subdir), names, shallow=False)
+        assert match == names
+
+
+def default_mode() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def test_manifests_have_the_permissions_of_the_outputs(intent_dir, tmpdir):
+    outdir = str(tmpdir.join('out'))
+    export(intent_dir, outdir, seed=7)
+    for subdir in ['train', 'test']:
+        for filename in os.listdir(os.path.join(outdir, subdir)):
+            assert os.stat(os.path.join(outdir, subdir, filename)).st_mode & 0o777 == default_mode()
+
+
+def test_outputs_are_regenerated_when_the_output_changes(intent_dir, tmpdir, monkeypatch):
+    outdir = str(tmpdir.join('out'))
+    export(intent_dir, outdir, seed=7)
+    filenames = glob(os.path.join(outdir, '*', '*.json'))
+    for filename in filenames:
+        os.utime(filename, ns=(0, 0))
+
+    monkeypatch.setattr('chatter.loader.OUTPUT_VERSION', -1)
+    export(intent_dir, outdir, seed=7)
+    assert all(os.stat(filename).st_mtime_ns != 0 for filename in filenames)
+
+
+def test_exhaustive_sentences(intent_dir, tmpdir):
+    full = export_sentences(intent_dir, str(tmpdir.join('full.txt')), exhaustive=True).splitlines()
+    shards = [export_sentences(intent_dir, str(tmpdir.join(f'shard{i}.txt')), shard=(i, 3), exhaustive=True)
+              for i in range(1, 4)]
+    assert "".join(shards).splitlines() == full
+
+    loader = RasaNLULoader(0, exhaustive=True)
+    loader.load(intent_dir)
+    assert len(full) == sum(intent.get_possible_combination_count() for intent in loader.intents)
+    assert len(full) == sum(len(intent.training_examples) for intent in loader.intents)
+
+
+def test_exhaustive_and_coverage_are_exclusive():
+    with pytest.raises(ValueError):
+        RasaNLULoader(exhaustive=True, coverage=2)
+
+
+VALUES_INTENT = """
+find_product:
+  text:
+    - "I want {product} in {city}"
+  grammars: []
+  entities:
+    - city: !values cities.txt
+    - product:
+      - !values {file: products.csv, column: name}
+      - something else
+"""
+
+
+@pytest.fixture()
+def values_dir(tmpdir):
+    tmpdir.join('cities.txt').write("".join(f"city  {i}\n" + ("\n" if i % 1000 == 0 else "") for i in range(5000)))
+    tmpdir.join('products.csv').write('id,name\n1,"socks, red"\n2,shoes\n')
+    tmpdir.join('find_product.yml').write(VALUES_INTENT)
+    return tmpdir
+
+
+def test_values_are_read_from_external_files(values_dir):
+    loader = RasaNLULoader(20)
+    loader.load(str(values_dir.join('find_product.yml')))
+    intent, = loader.intents
+
+    cities = intent.grammars['city'].choices
+    assert len(cities) == 5000
+    assert cities[0] == 'city 0' and cities[-1] == 'city 4999'
+    # big files are read when a value is used, rather than copied
+    assert cities.is_lazy
+    assert list(intent.grammars['product'].choices) == ['socks, red', 'shoes', 'something else']
+
+    for example in intent.training_examples:
+        city = next(entity for entity in example.spans if entity.name == 'city')
+        assert city.value in cities
+
+    # the file is mapped again when the values are unpickled
+    values = pickle.loads(pickle.dumps(intent.grammars['city']))
+    assert values.choices[1234] == 'city 1234'
+
+
+def test_changed_value_files_are_regenerated(values_dir, tmpdir):
+    outfile = str(tmpdir.join('sentences.txt'))
+    export_sentences(str(values_dir), outfile, cache_dir=str(tmpdir.join('cache')))
+
+    values_dir.join('cities.txt').write("atlantis\n")
+    assert 'atlantis' in export_sentences(str(values_dir), outfile, cache_dir=str(tmpdir.join('cache')))
+
+
+def test_value_files_with_the_same_size_are_told_apart(tmpdir):
+    library = GrammarLibrary()
+    keys = set()
+    for name, values in [('a.txt', "paris\nrome\n"), ('b.txt', "oslo\nrome\n")]:
+        tmpdir.join(name).write(values)
+        keys.add(library.key('city', ValueFile(str(tmpdir.join(name))), True, {}))
+    assert len(keys) == 2
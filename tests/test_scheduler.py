@@ -0,0 +1,79 @@
+import random
+from collections import Counter, OrderedDict
+
+import pytest
+
+from chatter.rasa_nlu import RasaNLUIntent
+from chatter.scheduler import TemplateScheduler, allocate, largest_remainder
+
+from conftest import load_intent
+
+
+@pytest.mark.parametrize("total, weights, shares", [
+    (10, [1, 1, 1], [4, 3, 3]),
+    (7, [5, 0, 2], [5, 0, 2]),
+    (3, [10 ** 30, 2 * 10 ** 30], [1, 2]),
+    (5, [0, 0], [0, 0]),
+])
+def test_largest_remainder(total, weights, shares):
+    assert largest_remainder(total, weights) == shares
+
+
+def test_allocate_in_proportion_to_the_unused_combinations():
+    assert allocate(10, available=[4, 40, 16], counts=[4, 40, 16], minimums=[0, 0, 0]) == [1, 7, 2]
+    # the minimums come first, and no template is given more than it has left until they have all run out
+    assert allocate(20, available=[2, 100, 8], counts=[2, 100, 8], minimums=[1, 0, 5]) == [1, 14, 5]
+    assert allocate(12, available=[2, 3, 5], counts=[2, 3, 5], minimums=[0, 0, 0]) == [2, 4, 6]
+
+
+def test_scheduler_locates_every_example_once():
+    scheduler = TemplateScheduler([3, 0, 2, 4], random.Random(4))
+    examples = [scheduler.locate(position) for position in range(9)]
+    assert sorted(examples) == [(0, 0), (0, 1), (0, 2), (2, 0), (2, 1), (3, 0), (3, 1), (3, 2), (3, 3)]
+
+    np = pytest.importorskip('numpy')
+    templates, ranks = scheduler.locate_batch(np.arange(9))
+    assert list(zip(templates.tolist(), ranks.tolist())) == examples
+
+
+def test_no_duplicates_until_every_combination_is_used(monkeypatch):
+    monkeypatch.setattr(RasaNLUIntent, 'batch_size', 0)
+    intent = load_intent(
+        text=["{greetings}", "{greetings} {locations}", "{locations} {greetings} {locations}"],
+        grammars=[OrderedDict(greetings=['hi', 'hello'])],
+        entities=[OrderedDict(locations=[str(i) for i in range(10)])])
+    total = intent.get_possible_combination_count()
+
+    combinations = [(text, tuple(seq)) for text, seq in intent.get_combinations(total)]
+    assert len(set(combinations)) == total
+
+    counts = Counter(text for text, _ in combinations)
+    assert counts == Counter({parser.text: parser.possible_combinations for parser in intent.text_parsers})
+
+
+def test_important_texts_are_always_used():
+    intent = load_intent(
+        text=[OrderedDict(important=["{greetings}", "hey {greetings}"]), "{greetings} {locations}"],
+        grammars=[OrderedDict(greetings=['hi', 'hello'])],
+        entities=[OrderedDict(locations=[str(i) for i in range(1000)])])
+    assert intent.texts.important_count == 2
+
+    texts = set(text for text, _ in intent.get_combinations(3))
+    assert texts == {"{greetings}", "hey {greetings}", "{greetings} {locations}"}
+
+
+@pytest.mark.parametrize("batch_size", [0, 7])
+def test_slices_match_a_full_run(monkeypatch, batch_size):
+    if batch_size:
+        pytest.importorskip('numpy')
+    monkeypatch.setattr(RasaNLUIntent, 'batch_size', batch_size)
+    data = dict(
+        text=["{greetings}", "{greetings} {locations}", "{locations} {greetings} {locations}"],
+        grammars=[OrderedDict(greetings=['hi', 'hello'])],
+        entities=[OrderedDict(locations=[str(i) for i in range(10)])])
+
+    full = list(load_intent(seed=3, **data).get_combinations(250))
+    # the repeats after every unique combination was used are also addressable
+    sliced = [combination for start in range(0, 250, 60)
+              for combination in load_intent(seed=3, **data).get_combinations(250, start, start + 60)]
+    assert sliced == full
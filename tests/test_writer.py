@@ -0,0 +1,30 @@
+import json
+from collections import OrderedDict
+
+import pytest
+
+from chatter.writer import RasaNLUWriter
+
+examples = [
+    dict(text="hi I want chinese", intent="restaurant_search",
+         entities=[dict(start=10, end=17, value="chinese", entity="cuisine")]),
+    dict(text="howdy", intent="restaurant_search", entities=[]),
+]
+synonyms = [dict(value="New York", synonyms=["the big apple", "New York city"])]
+
+
+@pytest.mark.parametrize("n_examples", [0, 1, 2], ids=['empty', 'single', 'multiple'])
+def test_writer_matches_json_dumps(tmpdir, n_examples):
+    filename = str(tmpdir.join("intent.json"))
+    with RasaNLUWriter(filename) as writer:
+        for example in examples[:n_examples]:
+            writer.write(example)
+        writer.close(synonyms)
+
+    expected = OrderedDict(rasa_nlu_data=OrderedDict(
+        regex_features=[],
+        common_examples=examples[:n_examples],
+        entity_synonyms=synonyms))
+
+    with open(filename) as fp:
+        assert fp.read() == json.dumps(expected, indent=2)